@@ -1,9 +1,11 @@
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 
 from app import app
 from components.common_layout import get_three_columns_layout, format_date
+from components.common_layout import add_cached_content_callback, get_cache_loaded_store
 from components.tests import get_all_weeks, get_tests_in_week, get_vms_of_test, get_test_history
 
 
@@ -17,6 +19,7 @@ layout = html.Div(className='centered-column', children=[
             dcc.Dropdown(placeholder="Please select a test first")
         ]),
     ),
+    html.Div(id='days_div', style={'width': '300px'}),
     html.Div(id='plot_div')
 ])
 
@@ -50,35 +53,42 @@ def insert_tests_dropdown(week):
     return dcc.Dropdown(id='tests_dropdown', options=tests)
 
 
-@app.callback(Output('vm_div', 'children'),
+@app.callback([Output('vm_div', 'children'), Output('days_div', 'children')],
               [Input('tests_dropdown', 'value')])
 def insert_vms_dropdown(test):
     """
-    Insert the vm dropdown upon selection of test. Only displays vms on which
-    the given test actually ran.
+    Insert the vm and the period dropdown upon selection of test. Only
+    displays vms on which the given test actually ran. Both dropdowns are
+    inserted together with the plot's cache store since the plot depends on
+    all of them.
 
     :param test: selected test (string, e.g. 'dns')
-    :returns: dcc.Dropdown
+    :returns: dcc.Dropdown, list of dcc.Dropdown & dcc.Store or None
     """
     # Catch unselection of test
     if test is None:
-        return dcc.Dropdown(placeholder="Please select a test first")
+        return [dcc.Dropdown(placeholder="Please select a test first"), None]
     vms = [{'label': vm, 'value': vm} for vm in get_vms_of_test(test)]
-    return dcc.Dropdown(id='vms_dropdown', options=vms)
+    # Longer periods show older results rolled up per hour or day
+    days = dcc.Dropdown(id='days_dropdown', value=7, clearable=False,
+                        options=[{'label': 'Last {0} days'.format(d),
+                                  'value': d} for d in [7, 30, 90, 365]])
+    return [dcc.Dropdown(id='vms_dropdown', options=vms),
+            [days, get_cache_loaded_store('history')]]
 
 
-@app.callback(Output('plot_div', 'children'),
-              [Input('vms_dropdown', 'value')],
-              [State('tests_dropdown', 'value')])
-def insert_plot(vm, test):
+def insert_plot(vm, days, test):
     """
     Inserts the plot into the plot_div div.
 
     :param vm: the selected vm (string, e.g. 'vm01')
+    :param days: the selected period in days (int, e.g. 7)
     :param test: the selected test (string, e.g. 'dns')
     :returns: dcc.Graph
     """
-    tests = get_test_history(test, vm)
+    if vm is None or test is None:
+        raise PreventUpdate
+    tests = get_test_history(test, vm, days)
     # Extract date, passed, failed, output and bring them to the right format
     date = map(format_date, tests['date'])
     date = list(map(lambda x: x[0].upper() + x[1:], date))
@@ -103,3 +113,10 @@ def insert_plot(vm, test):
         },
         config={'displayModeBar': False}
     )
+
+
+# Insert the plot, kept in the browser until new results arrive
+add_cached_content_callback('history', Output('plot_div', 'children'),
+                            [Input('vms_dropdown', 'value'),
+                             Input('days_dropdown', 'value')],
+                            [State('tests_dropdown', 'value')], insert_plot)
@@ -1,19 +1,19 @@
+from itertools import repeat
 import dash_html_components as html
 from dash.dependencies import Input, Output
 
-from app import app
-from components.common_layout import get_test_summarizing_layout
-from components.tests import get_all_weeks, get_tests_in_week
+from components.common_layout import get_test_summarizing_layout, add_cached_content_callback
+from components.common_layout import get_cache_loaded_store
+from components.tests import get_all_weeks, get_tests_in_week, get_last_tests
 
 
 layout = html.Div([
     html.H2('Status page', id='status-headline'),
-    html.Div(className='centered-column', id='status-weeks-div')
+    html.Div(className='centered-column', id='status-weeks-div'),
+    get_cache_loaded_store('status')
 ])
 
 
-@app.callback(Output('status-weeks-div', 'children'),
-              [Input('status-headline', 'children')])
 def insert_tests(_):
     """
     Combines the different weeks' layouts into one.
@@ -21,19 +21,31 @@ def insert_tests(_):
     :returns: combined layout (list of html.Divs)
     """
     weeks = get_all_weeks()
+    weekly_tests = list(map(get_tests_in_week, weeks))
+    # Look up the results of all weeks' tests at once
+    last_tests = get_last_tests([t for tests in weekly_tests for t in tests])
     # Filter out None's
-    layout = list(filter(None, map(get_week_layout, weeks)))
+    layout = list(filter(None, map(get_week_layout, weeks, weekly_tests,
+                                   repeat(last_tests, len(weeks)))))
     return layout
 
 
-def get_week_layout(week):
+def get_week_layout(week, tests, last_tests):
     """
     Returns one week's layout.
 
     :param week: week to build layout for
+    :param tests: the tests in this week (list of strings, e.g. ['dns'])
+    :param last_tests: results returned by get_last_tests
     :returns: layout for that week (html.Div or None if week does not have tests)
     """
-    # Get the tests in this week and calculate their fail/pass
-    tests = get_tests_in_week(week)
     week = str(week)
-    return get_test_summarizing_layout(tests, 'Week ' + week, '/?week=' + week)
+    return get_test_summarizing_layout(tests, 'Week ' + week, '/?week=' + week,
+                                       last_tests=last_tests)
+
+
+# Insert the weeks' layouts, kept in the browser and, being the same for all
+# users, in the server until new results arrive
+add_cached_content_callback('status', Output('status-weeks-div', 'children'),
+                            [Input('status-headline', 'children')], [],
+                            insert_tests, shared=True)
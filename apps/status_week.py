@@ -3,10 +3,10 @@ from itertools import repeat
 import dash_html_components as html
 from dash.dependencies import Input, Output, State
 
-from app import app
 from components.tests import get_tests_in_week
 from components.common_layout import get_results_list, get_test_layout
 from components.common_layout import add_test_details_callbacks, add_heading_from_search_callback
+from components.common_layout import add_cached_content_callback, get_cache_loaded_store
 
 
 layout = html.Div([
@@ -14,13 +14,11 @@ layout = html.Div([
         html.Span('Week ', id='week-heading-part1'),
         html.Span('', id='week-heading-part2'),
     ]),
-    html.Div(id='week-tests-div')
+    html.Div(id='week-tests-div'),
+    get_cache_loaded_store('week')
 ])
 
 
-@app.callback(Output('week-tests-div', 'children'),
-              [Input('week-heading-part1', 'children')],
-              [State('url', 'search')])
 def insert_tests(_, search):
     """
     Returns the layout containing the tests for one week.
@@ -43,6 +41,10 @@ def insert_tests(_, search):
     return html.Div(className='centered-column', children=test_layouts)
 
 
+# Insert the week's tests, kept in the browser until new results arrive
+add_cached_content_callback('week', Output('week-tests-div', 'children'),
+                            [Input('week-heading-part1', 'children')],
+                            [State('url', 'search')], insert_tests)
 # Set the week from a callback depending on search
 add_heading_from_search_callback('week')
 # Add callbacks for toggling test's visibility
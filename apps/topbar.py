@@ -1,12 +1,13 @@
 from datetime import datetime
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.exceptions import PreventUpdate
-from dash.dependencies import Input, Output, State
+from dash import callback_context
+from dash.dependencies import Input, Output, State, ClientsideFunction
 
 from app import app
 from components import auth
-from components.tests import formatted_next_tests_scheduled, add_test_scheduling, scheduled_test_ran_since
+from components.tests import add_test_scheduling, scheduled_test_ran_since
+from components.tests import get_schedule_state
 from components.common_layout import get_two_columns_layout, get_three_columns_layout
 
 
@@ -20,7 +21,13 @@ next_button = html.Div(className='center-align', children=[
     html.Button(id='next_test_button',
                 className="topbar-button",
                 disabled=True),
-    dcc.Interval(id='interval', interval=10000),
+    # Only drives callbacks running in the browser, see assets/callbacks.js
+    dcc.Interval(id='interval', interval=1000),
+    # The results generation, set when the server notifies of new test
+    # results or schedules, see components/events.py
+    dcc.Store(id='results_generation'),
+    # The next test's time and whether an update is available
+    dcc.Store(id='next_test'),
     html.Button(id='creation_date',
                 style={'display': 'none'})
 ])
@@ -38,96 +45,82 @@ layout = html.Div(className="topbar", children=[
 ])
 
 
-@app.callback([Output('status_link', 'className'),
-               Output('vm_link', 'className'),
-               Output('history_link', 'className'),
-               Output('username_link', 'className')],
-              [Input('url', 'pathname')])
-def highlight_current_page(pathname):
-    """
-    Highlights the currently opened page by changing css classes of links.
+# Highlights the currently opened page by changing css classes of links,
+# runs in the browser (see assets/callbacks.js)
+app.clientside_callback(
+    ClientsideFunction('status_monitor', 'highlight_current_page'),
+    [Output('status_link', 'className'),
+     Output('vm_link', 'className'),
+     Output('history_link', 'className'),
+     Output('username_link', 'className')],
+    [Input('url', 'pathname')]
+)
 
-    :param pathname: the current url
-    :returns: list of classNames (strings)
-    """
-    if pathname is None:
-        raise PreventUpdate
-    elif pathname == '/':
-        return ['active', '', '', '']
-    elif pathname == '/vms':
-        return ['', 'active', '', '']
-    elif pathname == '/history':
-        return ['', '', 'active', '']
-    elif pathname == '/account':
-        return ['', '', '', 'active']
-    else:
-        return ['', '', '', '']
-
-
-@app.callback(Output('username_link', 'children'),
-              [Input('url', 'pathname')])
-def set_username(_):
-    """
-    Sets the session's username in the right column.
-
-    :returns: the current username (string)
-    """
-    if auth.is_authorized():
-        return auth.get_username()
 
-
-@app.callback(Output('next_test_button', 'children'),
-              [Input('next_test_button', 'n_clicks'),
-               Input('interval', 'n_intervals'),
+@app.callback([Output('username_link', 'children'),
+               Output('next_test', 'data'),
+               Output('next_test_button', 'style'),
+               Output('schedule_tests_div', 'style'),
+               Output('creation_date', 'children')],
+              [Input('url', 'pathname'),
+               Input('url', 'search'),
+               Input('results_generation', 'data'),
+               Input('next_test_button', 'n_clicks'),
                Input('schedule_tests_div', 'n_clicks')],
               [State('creation_date', 'children')])
-def insert_next_test(_, __, ___, date):
+def update_topbar(_, __, ___, ____, _____, date):
     """
-    Inserts the text for the button displaying the time of the next scheduled
-    test.
+    Updates the topbar's state in a single request, looking the session and
+    the test schedule up once each: the username, the time of the next
+    scheduled test and the buttons' visibility, which depends on whether the
+    user is logged in and an admin. Runs when the server notifies of new test
+    results or schedules instead of periodically, the next test's button
+    counts down in the browser.
 
-    :param date: if tests have been scheduled since date, show update available
-    :returns: time until next test schedule or update available (string)
-    """
+    When url or search changes, page content updates. Saves the time of last
+    url/search change, if tests have been scheduled since, update available
+    is shown instead of the next test's time.
+
+    :param date: time of last url change, datetime isoformat (string)
+    :returns: username, next test's time and whether an update is available,
+              styles of the next test's and the test scheduling button, time
+              of last url change
+    """
+    triggered = set(map(lambda x: x['prop_id'], callback_context.triggered))
+    # '.' means page load
+    if not triggered.isdisjoint(['url.pathname', 'url.search', '.']):
+        date = datetime.utcnow().isoformat()
+    hidden = {'display': 'none'}
     if not auth.is_authorized():
-        return
-    if date is not None and scheduled_test_ran_since(date):
-        return "update available"
-    return "next " + formatted_next_tests_scheduled()
-
-
-@app.callback(Output('next_test_button', 'style'),
-              [Input('url', 'pathname'),
-               Input('url', 'search'),
-               Input('interval', 'n_intervals')])
-def toggle_next_test(_, __, ___):
-    """
-    Toggles the next test's button visibility depending on whether user is
-    logged in.
-
-    :returns: html style
-    """
-    if auth.is_authorized():
-        return {}
-    else:
-        return {'display': 'none'}
-
-
-@app.callback(Output('schedule_tests_div', 'style'),
-              [Input('url', 'pathname'),
-               Input('url', 'search'),
-               Input('interval', 'n_intervals')])
-def toggle_schedule_button(_, __, ___):
-    """
-    Toggles the test scheduling button's visibility depending on whether user
-    is logged in and an admin.
-
-    :returns: html style
-    """
-    if auth.is_authorized() and auth.is_admin():
-        return {}
-    else:
-        return {'display': 'none'}
+        return [None, None, hidden, hidden, date]
+    state = get_schedule_state()
+    next_test = {
+        'next': None if state['next'] is None else state['next'].isoformat(),
+        'update': scheduled_test_ran_since(date, state)
+    }
+    schedule_style = {} if auth.is_admin() else hidden
+    return [auth.get_username(), next_test, {}, schedule_style, date]
+
+
+# Formats the next test's time relative to now, runs in the browser (see
+# assets/callbacks.js)
+app.clientside_callback(
+    ClientsideFunction('status_monitor', 'format_next_test'),
+    Output('next_test_button', 'children'),
+    [Input('interval', 'n_intervals'),
+     Input('next_test', 'data')]
+)
+
+
+# Listens to the server's notifications of new test results or schedules,
+# runs in the browser (see assets/callbacks.js)
+app.clientside_callback(
+    ClientsideFunction('status_monitor', 'watch_results_generation'),
+    Output('results_generation', 'data'),
+    [Input('interval', 'n_intervals')],
+    [State('results_generation', 'data'),
+     State('username_link', 'children')]
+)
 
 
 @app.callback(Output('schedule_tests_div', 'children'),
@@ -153,28 +146,12 @@ def insert_schedule_tests_button(n):
         return html.Button('Scheduled', className='topbar-button')
 
 
-@app.callback(Output('creation_date', 'children'),
-              [Input('creation_date', 'role'),
-               Input('url', 'pathname'),
-               Input('url', 'search')])
-def save_creation_date(_, __, ___):
-    """
-    When url or search changes, page content updates. Saves the time of last
-    url/search change.
-
-    :returns: time of last url change, datetime isoformat (string)
-    """
-    return datetime.utcnow().isoformat()
-
-
-@app.callback(Output('schedule_tests_div', 'n_clicks'),
-              [Input('url', 'pathname'),
-               Input('url', 'search')])
-def reset_schedule_button(_, __):
-    """
-    When url or search changes, page content updates. Resets the schedule
-    button upon url/search changes.
-
-    :returns: None
-    """
-    return None
+# When url or search changes, page content updates. Resets the schedule
+# button upon url/search changes, runs in the browser (see
+# assets/callbacks.js)
+app.clientside_callback(
+    ClientsideFunction('status_monitor', 'reset_schedule_button'),
+    Output('schedule_tests_div', 'n_clicks'),
+    [Input('url', 'pathname'),
+     Input('url', 'search')]
+)
@@ -1,20 +1,20 @@
+from itertools import repeat
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output
 
-from app import app
-from components.tests import get_all_vms, get_tests_names_of_vm
-from components.common_layout import get_test_summarizing_layout
+from components.tests import get_all_vms, get_tests_names_of_vm, get_last_tests
+from components.common_layout import get_test_summarizing_layout, add_cached_content_callback
+from components.common_layout import get_cache_loaded_store
 
 
 layout = html.Div([
     html.H2('Your VMs', id='vm-headline'),
-    html.Div(className='centered-column', id='vms-div')
+    html.Div(className='centered-column', id='vms-div'),
+    get_cache_loaded_store('vms')
 ])
 
 
-@app.callback(Output('vms-div', 'children'),
-              [Input('vm-headline', 'children')])
 def insert_tests(_):
     """
     Combines the individual vm layouts.
@@ -22,16 +22,29 @@ def insert_tests(_):
     :returns: combined layout (list of html.Div)
     """
     vms = get_all_vms()
-    layout = list(filter(None, map(get_vm_layout, vms)))
+    vm_tests = list(map(get_tests_names_of_vm, vms))
+    # Look up the results of all vms' tests at once
+    last_tests = get_last_tests(list(set(t for tests in vm_tests for t in tests)))
+    layout = list(filter(None, map(get_vm_layout, vms, vm_tests,
+                                   repeat(last_tests, len(vms)))))
     return layout
 
 
-def get_vm_layout(vm):
+def get_vm_layout(vm, tests, last_tests):
     """
     Creates the layout for one vm.
 
     :param vm: the vm to create a layout for
+    :param tests: the vm's tests (list of strings, e.g. ['dns'])
+    :param last_tests: results returned by get_last_tests
     :returns: layout (html.Div or None)
     """
-    tests = get_tests_names_of_vm(vm)
-    return get_test_summarizing_layout(tests, vm, '/vms?vm=' + vm, vm=vm)
+    return get_test_summarizing_layout(tests, vm, '/vms?vm=' + vm, vm=vm,
+                                       last_tests=last_tests)
+
+
+# Insert the vms' layouts, kept in the browser and, being the same for all
+# users, in the server until new results arrive
+add_cached_content_callback('vms', Output('vms-div', 'children'),
+                            [Input('vm-headline', 'children')], [],
+                            insert_tests, shared=True)
@@ -4,10 +4,10 @@ from itertools import repeat
 import dash_html_components as html
 from dash.dependencies import Input, Output, State
 
-from app import app
-from components.tests import get_tests_of_vm
+from components.tests import get_tests_of_vm, get_last_tests
 from components.common_layout import get_results_list, get_test_layout
 from components.common_layout import add_test_details_callbacks, add_heading_from_search_callback
+from components.common_layout import add_cached_content_callback, get_cache_loaded_store
 
 
 layout = html.Div([
@@ -15,21 +15,23 @@ layout = html.Div([
         html.Span('VM ', id='vm-heading-part1'),
         html.Span('', id='vm-heading-part2'),
     ]),
-    html.Div(id='vm-tests-div')
+    html.Div(id='vm-tests-div'),
+    get_cache_loaded_store('vm')
 ])
 
 
-def get_week_layout(args, vm):
+def get_week_layout(args, vm, last_tests):
     """
     Get the layout of one week for a given VM.
 
     :param args: a tuple/list in the format [week, [test1, ...], [id1, ...]]
     :param vm: the VM's name
+    :param last_tests: results returned by get_last_tests
     :returns: the week's layout (a div)
     """
     week, tests, ids = args
-    # Get the test passed, failed and output from database
-    results_list = get_results_list(tests, vm)
+    # Pick the test passed, failed and output from the vm's results
+    results_list = get_results_list(tests, vm, last_tests)
     # Get the layout for each test and filter empty ones
     vm_name = repeat('vm', len(tests))
     tests_layout = map(get_test_layout, tests, results_list, ids, vm_name)
@@ -74,9 +76,6 @@ def format_weeks_tests(tests):
     return [(weeks[i], weekly_tests[i], ids[i]) for i in range(len(weeks))]
 
 
-@app.callback(Output('vm-tests-div', 'children'),
-              [Input('vm-heading-part1', 'children')],
-              [State('url', 'search')])
 def insert_tests(_, search):
     """
     Insert the tests when the page is rendered
@@ -88,21 +87,29 @@ def insert_tests(_, search):
     # Extract the vm from search
     try:
         parsed_search = parse.parse_qs(search[1:])
-        vm = parsed_search['vm']
+        vm = parsed_search['vm'][0]
     # In case extraction fails, return error
     except Exception as _:
         return []
     # Get the tests of the VM and format into something useful
     tests = get_tests_of_vm(vm)
     weekly_tests = format_weeks_tests(tests)
+    # Get the results of all the vm's tests at once
+    last_tests = get_last_tests(list(map(lambda x: x[1], tests)), vm)
     # Get the weeks' layouts
     vms = repeat(vm, len(weekly_tests))
-    weeks_layout = list(filter(None, map(get_week_layout, weekly_tests, vms)))
+    last_tests = repeat(last_tests, len(weekly_tests))
+    weeks_layout = list(filter(None, map(get_week_layout, weekly_tests, vms,
+                                         last_tests)))
     # Return a centered version of the weeks' layouts
     layout = html.Div(className="centered-column", children=weeks_layout)
     return layout
 
 
+# Insert the vm's tests, kept in the browser until new results arrive
+add_cached_content_callback('vm', Output('vm-tests-div', 'children'),
+                            [Input('vm-heading-part1', 'children')],
+                            [State('url', 'search')], insert_tests)
 # Set the vm from a callback depending on search
 add_heading_from_search_callback('vm')
 # Add callbacks for toggling test's visibility
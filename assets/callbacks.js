@@ -0,0 +1,191 @@
+/* Callbacks run in the browser, registered with app.clientside_callback */
+
+/* Milliseconds after which a closed event stream may be reopened */
+var RECONNECT_INTERVAL = 30000;
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    status_monitor: {
+        /**
+         * Highlights the currently opened page by changing css classes of
+         * the topbar's links, see apps/topbar.py.
+         *
+         * @param pathname the current url's path
+         * @returns list of classNames
+         */
+        highlight_current_page: function(pathname) {
+            if (pathname === undefined || pathname === null) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+            var pages = ['/', '/vms', '/history', '/account'];
+            return pages.map(function(page) {
+                return page === pathname ? 'active' : '';
+            });
+        },
+
+        /**
+         * Resets the test scheduling button when the url changes, see
+         * apps/topbar.py.
+         *
+         * @returns the button's number of clicks, null
+         */
+        reset_schedule_button: function() {
+            return null;
+        },
+
+        /**
+         * Formats the time of the next scheduled test relative to now, see
+         * apps/topbar.py.
+         *
+         * @param _ ignored
+         * @param next_test the next test's time and whether an update is
+         *                  available
+         * @returns the next test's button's children
+         */
+        format_next_test: function(_, next_test) {
+            if (next_test === undefined || next_test === null) {
+                return null;
+            }
+            if (next_test.update) {
+                return 'update available';
+            }
+            return 'next ' + format_next(next_test.next);
+        },
+
+        /**
+         * Returns the results generation once the server notified of new
+         * test results or schedules, see components/events.py. Opens the
+         * event stream for logged in users, reopening it at most every
+         * RECONNECT_INTERVAL once the server closed it.
+         *
+         * @param _ ignored
+         * @param generation the generation returned last
+         * @param username the logged in user
+         * @returns the current generation
+         */
+        watch_results_generation: function(_, generation, username) {
+            var events = window.status_monitor_events;
+            var closed = events === undefined ||
+                events.source.readyState === EventSource.CLOSED;
+            if (username && closed && (events === undefined ||
+                    Date.now() - events.opened >= RECONNECT_INTERVAL)) {
+                events = open_events();
+            }
+            if (events === undefined || events.generation === null ||
+                    events.generation === generation) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+            return events.generation;
+        },
+
+        /**
+         * Inserts a page's content kept in the browser once the server
+         * confirmed it is the one to insert, see
+         * components/common_layout.py:add_cached_content_callback.
+         *
+         * @param loaded the key of the content to insert
+         * @param content the kept content
+         * @param key the kept content's generation and arguments
+         * @returns the content
+         */
+        insert_cached_content: function(loaded, content, key) {
+            if (loaded === undefined || loaded === null || key === undefined ||
+                    key === null || content === undefined ||
+                    JSON.stringify(loaded) !== JSON.stringify(key)) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+            return content;
+        },
+
+        /**
+         * Shows or hides a test's output, see
+         * components/common_layout.py:add_test_details_callbacks. Requests
+         * the output from the server when it is shown for the first time.
+         *
+         * @param n number of clicks of the test's toggle button
+         * @returns style of the output, toggle button's children & title,
+         *          whether to load the output
+         */
+        toggle_test_output: function(n) {
+            if (n === undefined || n === null) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+            var load = n === 1 ? true : window.dash_clientside.no_update;
+            if (n % 2 === 0) {
+                return [{'display': 'none'}, triangle('triangle-down'),
+                        'Show test output', load];
+            }
+            return [{}, triangle('triangle-up'), 'Hide test output', load];
+        },
+
+        /**
+         * Returns the 2nd part of a page heading from the url's search, see
+         * components/common_layout.py:add_heading_from_search_callback.
+         *
+         * @param _ ignored
+         * @param search the current url's search
+         * @param trigger_id id of the heading's 1st part, <preset>-heading-part1
+         * @returns the values of the search argument <preset>
+         */
+        insert_heading: function(_, search, trigger_id) {
+            var id_preset = trigger_id.replace(/-heading-part1$/, '');
+            return new URLSearchParams(search || '').getAll(id_preset);
+        }
+    }
+});
+
+/**
+ * Returns the layout of a toggle button's triangle.
+ *
+ * @param className 'triangle-down' or 'triangle-up'
+ * @returns html.Div as understood by dash
+ */
+function triangle(className) {
+    return {
+        'namespace': 'dash_html_components',
+        'type': 'Div',
+        'props': {'className': className}
+    };
+}
+
+/**
+ * Formats a time relative to now, e.g. 'never', 'now', 'in 2 days'.
+ *
+ * @param next the time, datetime isoformat in UTC, or null
+ * @returns the formatted time
+ */
+function format_next(next) {
+    if (next === null) {
+        return 'never';
+    }
+    var seconds = Math.floor(
+        (Date.parse(next.slice(0, 19) + 'Z') - Date.now()) / 1000);
+    if (seconds <= 0) {
+        return 'now';
+    }
+    if (seconds >= 86400) {
+        return 'in ' + Math.floor(seconds / 86400) + ' days';
+    }
+    if (seconds >= 60) {
+        return 'in ' + Math.floor(seconds / 60) + ' min.';
+    }
+    return 'in ' + seconds + ' sec.';
+}
+
+/**
+ * Opens the event stream notifying of new test results or schedules, see
+ * components/events.py.
+ *
+ * @returns the stream's state, also kept in window.status_monitor_events
+ */
+function open_events() {
+    var events = {
+        source: new EventSource('/events'),
+        opened: Date.now(),
+        generation: null
+    };
+    events.source.onmessage = function(e) {
+        events.generation = JSON.parse(e.data).generation;
+    };
+    window.status_monitor_events = events;
+    return events;
+}
@@ -2,14 +2,19 @@ import bcrypt
 import pymysql
 import secrets
 import datetime
-from flask import request
+from flask import g, request
 from components.sql import Cursor, WriteCursor
+from components.cache import LRUCache
+from components.config import SESSION_CACHE_SIZE, SESSION_CACHE_TTL
 import dash_core_components as dcc
 
 
 # A redirect to the login page to be used in the case of e.g. expired sessions
 login_page_redirect = dcc.Location(pathname='/login', id='')
 
+# Process-local cache of looked up sessions, keyed by session key
+session_cache = LRUCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL)
+
 
 def login(username, password):
     """
@@ -45,53 +50,99 @@ def logout():
     """
     Sets the user's current session as logged out.
     """
-    if is_authorized():
-        session = request.cookies['session']
+    if not is_authorized():
+        return
+    session = request.cookies['session']
     with WriteCursor() as c:
         sql = """update sessions
               set logout = utc_timestamp()
               where id = %s;"""
         c.execute(sql, (session))
+    # The cached and memoized auth contexts are outdated now
+    session_cache.delete(session)
+    g.pop('auth_context', None)
+
+
+# A session's user, admin flag, whether it is active and its seconds left
+SESSION_SQL = """select sessions.username, users.admin,
+                  sessions.expires >= utc_timestamp()
+                  and sessions.logout >= utc_timestamp(),
+                  timestampdiff(second, utc_timestamp(),
+                                least(sessions.expires, sessions.logout))
+              from sessions
+              inner join users on sessions.username = users.username
+              where sessions.id = %s;"""
+
+
+def lookup_session(session):
+    """
+    Looks up a session and its user with a single query. Results are cached
+    for up to SESSION_CACHE_TTL seconds, but never beyond the session's
+    expiry or logout.
+
+    :param session: session key (string)
+    :returns: dict with authorized (boolean), username (string or None) and
+              admin (boolean), e.g. {'authorized': True, 'username': 'admin',
+              'admin': True}
+    """
+    context = session_cache.get(session)
+    if context is not None:
+        return context
+    with Cursor() as c:
+        c.execute(SESSION_SQL, (session))
+        row = c.fetchone()
+    # Unknown session, nobody is logged in
+    if row is None:
+        context = {'authorized': False, 'username': None, 'admin': False}
+        session_cache.set(session, context)
+        return context
+    username, admin, active, remaining = row
+    context = {'authorized': bool(active), 'username': username,
+               'admin': bool(admin)}
+    # An active session must not outlive its expiry in the cache
+    session_cache.set(session, context, remaining if active else None)
+    return context
+
+
+def get_auth_context():
+    """
+    Returns the auth context of the current request, i.e. whether it is
+    authorized and the session's username and admin flag.
+
+    The session is looked up at most once per request, the result is
+    memoized on flask.g.
+
+    :returns: dict, see lookup_session
+    """
+    if 'auth_context' not in g:
+        # If cookie is not even set, request is unauthorized for sure
+        if 'session' not in request.cookies:
+            g.auth_context = {'authorized': False, 'username': None,
+                              'admin': False}
+        else:
+            g.auth_context = lookup_session(request.cookies['session'])
+    return g.auth_context
 
 
 def is_authorized():
     """
     Checks whether the request is coming from an authorized session.
 
-    Uses the cookies username and session and checks whether this combination
-    also exists in the valid (and not expired) sessions in the database.
+    Uses the session cookie and checks whether this session also exists in
+    the valid (and not expired) sessions in the database.
 
     :returns: whether request is authorized (boolean)
     """
-    # If cookie is not even set, request is unauthorized for sure
-    if 'session' not in request.cookies:
-        return False
-    # Extract session key from cookie
-    session = request.cookies['session']
-    # Check whether session exists
-    sql = """select * from sessions
-          where expires >= utc_timestamp() and logout >= utc_timestamp() and id = %s;"""
-    with Cursor() as c:
-        c.execute(sql, (session))
-        session_active = len(c.fetchall()) >= 1
-    return session_active
+    return get_auth_context()['authorized']
 
 
 def get_username():
     """
     Returns the username associated with the current session.
 
-    :returns: username (string), or None in case of expired/nonexistent session
+    :returns: username (string), or None in case of nonexistent session
     """
-    if 'session' not in request.cookies:
-        return None
-    with Cursor() as c:
-        sql = """select username
-              from sessions
-              where id = %s;"""
-        c.execute(sql, (request.cookies['session']))
-        username = c.fetchone()
-    return None if username is None else username[0]
+    return get_auth_context()['username']
 
 
 def is_admin():
@@ -100,16 +151,7 @@ def is_admin():
 
     :returns: session's user is admin (boolean)
     """
-    # Try to get username, if not logged in return False
-    username = get_username()
-    if username is None:
-        return False
-    with Cursor() as c:
-        sql = """select admin
-              from users
-              where username = %s;"""
-        c.execute(sql, (username))
-        return c.fetchone()[0]
+    return get_auth_context()['admin']
 
 
 def add_user(username, admin, password):
@@ -156,4 +198,6 @@ def change_password(username, password):
               set pw_hash = %s
               where username = %s;"""
         c.execute(sql, (pw_hash, username))
+    # Make the user's sessions be checked against the database again
+    session_cache.delete_where(lambda _, context: context['username'] == username)
     return True
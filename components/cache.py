@@ -0,0 +1,87 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    A bounded, thread-safe least recently used cache whose entries expire
+    after a time to live.
+
+    Usage:
+        cache = LRUCache(100, 60)
+        cache.set('key', value)
+        value = cache.get('key')
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # Maps key to (value, expiry time as time.monotonic())
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value for key.
+
+        :param key: the key to look up
+        :param default: returned if key is not cached or expired
+        :returns: the cached value or default
+        """
+        with self.lock:
+            if key not in self.entries:
+                return default
+            value, expires = self.entries[key]
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Caches value for key, evicting the least recently used entry if the
+        cache is full.
+
+        :param key: the key to cache value for
+        :param value: the value to cache
+        :param ttl: seconds to keep value, capped at the cache's ttl
+                    (optional, defaults to the cache's ttl)
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            self.delete(key)
+            return
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        """
+        Removes key from the cache if it is cached.
+
+        :param key: the key to remove
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def delete_where(self, predicate):
+        """
+        Removes all entries for which predicate(key, value) is true.
+
+        :param predicate: function taking key and value, returning boolean
+        """
+        with self.lock:
+            keys = [k for k, (v, _) in self.entries.items() if predicate(k, v)]
+            for key in keys:
+                del self.entries[key]
+
+    def clear(self):
+        """
+        Removes all entries from the cache.
+        """
+        with self.lock:
+            self.entries.clear()
@@ -1,25 +1,45 @@
+import json
 import datetime
-from urllib import parse
 from itertools import repeat
+from plotly.utils import PlotlyJSONEncoder
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, MATCH
+from dash.dependencies import ClientsideFunction
+from dash import no_update
 
 from app import app
-from components.tests import get_last_test, summarize_tests
+from components.tests import get_last_tests, pick_last_test, summarize_tests
+from components.tests import get_test_result
+from components.events import get_generation
+from components.cache import LRUCache
+from components.config import FRAGMENT_CACHE_SIZE, FRAGMENT_CACHE_TTL
 
 
-def get_results_list(tests, vm=None):
+# Ids of the stores keeping the pages' content in the browser, see
+# add_cached_content_callback
+page_caches = []
+
+# Process-local cache of serialized page content shared by all users, keyed
+# by page, arguments and results generation
+fragment_cache = LRUCache(FRAGMENT_CACHE_SIZE, FRAGMENT_CACHE_TTL)
+
+
+def get_results_list(tests, vm=None, last_tests=None):
     """
     Gets a list of tests results.
 
     :param tests: a list of tests, e.g. ['dns', 'dhcp, ...]
-    :returns: a list of test results [[passed, failed, output, date, vm], ..]
+    :param vm: limit to results on this vm (string, e.g. 'vm01', optional)
+    :param last_tests: results returned by get_last_tests (optional, looked
+                       up if not given)
+    :returns: a list of test results [{'passed': 2, 'failed': 0, 'date': ...,
+              'vm': 'vm01'}, ..]
     """
-    if vm is None:
-        return list(map(get_last_test, tests))
-    else:
-        return list(map(get_last_test, tests, repeat(vm, len(tests))))
+    if last_tests is None:
+        last_tests = get_last_tests(tests, vm)
+    return list(map(pick_last_test, repeat(last_tests, len(tests)), tests,
+                    repeat(vm, len(tests))))
 
 
 def get_indicator(success):
@@ -62,7 +82,8 @@ def get_three_columns_layout(col1, col2, col3):
     ])
 
 
-def get_test_summarizing_layout(tests, left_col_name, href, vm='%'):
+def get_test_summarizing_layout(tests, left_col_name, href, vm=None,
+                                last_tests=None):
     """
     Gets a three column layout there the first column contains all tests
     passed indicator and the name of this set of tests. The middle column
@@ -72,12 +93,14 @@ def get_test_summarizing_layout(tests, left_col_name, href, vm='%'):
     :param tests: a list of tests (list of strings, e.g. ['dns', 'dhcp'])
     :param left_col_name: name of this set of tests (string, e.g. vm01 or week 1)
     :param href: the link's href (string)
+    :param vm: limit to results on this vm (string, e.g. 'vm01', optional)
+    :param last_tests: results returned by get_last_tests (optional)
     :returns: container with the layout (html.Div) or None if len(test) = 0
     """
     # If there are no tests, return nothing
     if len(tests) == 0:
         return None
-    passed, failed = summarize_tests(tests, vm=vm)
+    passed, failed = summarize_tests(tests, vm=vm, last_tests=last_tests)
     # Create left column
     left_column = [get_indicator(failed == 0),
                    html.Div(left_col_name, className='big-text')]
@@ -115,24 +138,58 @@ def format_date(date):
 
 def get_test_layout(name, results, id, id_preset):
     """
-    Returns the layout of a single test.
+    Returns the layout of a single test. The test's output is not part of
+    the layout, it is loaded when the test's output is first shown.
 
     : param name: the test's name, e.g. 'dhcp'
-    : param results: list[passed, failed, output, date, vm]
+    : param results: dict with passed, failed, date and vm
     : param id: the unique numeric id to identify this test to dash callbacks
     : param id_preset: what to preset ids, e.g. 'vm' or 'status'
     """
     # Variables to clean up below
     pass_msg = ('{0} of {1} tests passed'
                 .format(results['passed'], results['passed'] + results['failed']))
-    date = format_date(results['date'])
     details_button = html.Button(
         title='Show test output',
-        id='{0}-test-toggle-output-{1}'.format(id_preset, id),
+        id=get_test_id(id_preset, 'toggle-output', id),
         className='triangle-button',
         children=[html.Div(className='triangle-down')]
     )
-    # Create the test output layout
+    # Filled by the test details callback, see add_test_details_callbacks
+    output_layout = html.Div(
+        id=get_test_id(id_preset, 'output', id),
+        style={'display': 'none'}
+    )
+    # Identifies the test's result to load the output of
+    key = dcc.Store(
+        id=get_test_id(id_preset, 'key', id),
+        data={'test': name, 'vm': results['vm'],
+              'date': results['date'].isoformat()}
+    )
+    # Set once the output is to be loaded
+    load = dcc.Store(id=get_test_id(id_preset, 'load', id))
+    # Create main visible layout
+    left_column = [get_indicator(results['failed'] == 0),
+                   html.Div('Test {0}'.format(name), className='big-text')]
+    content_layout = get_three_columns_layout(
+        left_column, pass_msg, details_button)
+    # Combine the layouts into a test box and return it
+    return html.Div(className='box',
+                    children=[content_layout, output_layout, key, load])
+
+
+def get_test_output_layout(results):
+    """
+    Returns the layout of a test's output and where and when it ran.
+
+    :param results: dict with output, date and vm, e.g. returned by
+                    get_test_result, or None if the result does not exist
+    :returns: list of html.Divs
+    """
+    if results is None:
+        return [html.Div("The test's output is not available anymore",
+                         className='test-details')]
+    date = format_date(results['date'])
     details_layout = get_three_columns_layout(
         html.Div(
             "Executed on {0} {1}".format(results['vm'], date),
@@ -141,78 +198,180 @@ def get_test_layout(name, results, id, id_preset):
         dcc.Link("Test history", href='/history', id='history_link',
                  style={'margin-right': '55px'})
     )
-
     terminal_layout = html.Div(
-        # id='{0}-test-output-{1}'.format(id_preset, id),
         className='terminal',
         children=html.Div(list(map(html.Div, results['output'].split('\n'))))
     )
-    output_layout = html.Div(
-        id='{0}-test-output-{1}'.format(id_preset, id),
-        children=[terminal_layout, details_layout],
-        style={'display': 'none'}
-    )
-    # Create main visible layout
-    left_column = [get_indicator(results['failed'] == 0),
-                   html.Div('Test {0}'.format(name), className='big-text')]
-    content_layout = get_three_columns_layout(
-        left_column, pass_msg, details_button)
-    # Combine the layouts into a test box and return it
-    return html.Div(className='box', children=[content_layout, output_layout])
+    return [terminal_layout, details_layout]
 
 
 def add_heading_from_search_callback(id_preset):
     """
-    Returns a callback to add the 2nd part of a page heading on page load.
+    Adds a callback to add the 2nd part of a page heading on page load. The
+    callback runs in the browser, see assets/callbacks.js.
 
     :param id_preset: preset of id, e.g. <preset>-heading-part2, & search arg
     """
-    def generate_callback(id_preset):
-        def insert_heading(_, search):
-            parsed_search = parse.parse_qs(search[1:])
-            return parsed_search[id_preset]
-        return insert_heading
     trigger_id = id_preset + '-heading-part1'
     heading_id = id_preset + '-heading-part2'
     # Add the callback
-    app.callback(Output(heading_id, 'children'),
-                 [Input(trigger_id, 'children')],
-                 [State('url', 'search')])(
-        generate_callback(id_preset)
+    app.clientside_callback(
+        ClientsideFunction('status_monitor', 'insert_heading'),
+        Output(heading_id, 'children'),
+        [Input(trigger_id, 'children')],
+        [State('url', 'search'), State(trigger_id, 'id')]
     )
 
 
+def get_test_id(id_preset, kind, id):
+    """
+    Returns the id of one of a test's components, matched by the test
+    details callbacks of the id_preset, see add_test_details_callbacks.
+
+    :param id_preset: what to preset ids, e.g. 'vm' or 'week'
+    :param kind: the component, 'toggle-output', 'output', 'key' or 'load'
+    :param id: the test's numeric id (int) or MATCH
+    :returns: the id (dict)
+    """
+    return {'type': '{0}-test-{1}'.format(id_preset, kind), 'index': id}
+
+
 def add_test_details_callbacks(id_preset):
     """
-    This function will add callbacks for all possible tests.
-    Unfortunately, callbacks can not be dynamically generated for each new test
-    added. Therefore, we have to add a finite number of them and hope we never
-    need more.
-
-    :param id_preset: preset for id, e.g. <preset>-test-output-<number>
-    """
-    def generate_callbacks():
-        """
-        Generate the callback function for toggling test output visibility.
-
-        : returns: A callback function.
-        """
-        def toggle_test_output_visibility(n):
-            if n % 2 == 0:
-                return [{'display': 'none'},
-                        html.Div(className='triangle-down'),
-                        "Show test output"]
-            return [{}, html.Div(className='triangle-up'), "Hide test output"]
-        return toggle_test_output_visibility
-
-    # Iterate through i in '0', '1', '2', ...
-    for i in list(map(str, range(0, 100))):
-        toggle_id = id_preset + '-test-toggle-output-' + i
-        output_id = id_preset + '-test-output-' + i
-        # And add the callback to each possible test-more-button
-        app.callback([Output(output_id, 'style'),
-                      Output(toggle_id, 'children'),
-                      Output(toggle_id, 'title')],
-                     [Input(toggle_id, 'n_clicks')])(
-            generate_callbacks()
-        )
+    Adds the callbacks showing the output of any of the tests with the given
+    id preset. The callbacks match the tests' ids by pattern, so one
+    callback each handles all tests of a page, however many there are.
+
+    Toggling the output runs in the browser (see assets/callbacks.js), only
+    loading the output when it is first shown needs the server.
+
+    :param id_preset: preset for id, see get_test_id
+    """
+    def insert_test_output(_, key):
+        return get_test_output_layout(get_test_result(**key))
+
+    toggle_id = get_test_id(id_preset, 'toggle-output', MATCH)
+    output_id = get_test_id(id_preset, 'output', MATCH)
+    key_id = get_test_id(id_preset, 'key', MATCH)
+    load_id = get_test_id(id_preset, 'load', MATCH)
+    app.clientside_callback(
+        ClientsideFunction('status_monitor', 'toggle_test_output'),
+        [Output(output_id, 'style'),
+         Output(toggle_id, 'children'),
+         Output(toggle_id, 'title'),
+         Output(load_id, 'data')],
+        [Input(toggle_id, 'n_clicks')],
+        prevent_initial_call=True
+    )
+    # The output stays in the page once loaded
+    app.callback(Output(output_id, 'children'),
+                 [Input(load_id, 'data')],
+                 [State(key_id, 'data')],
+                 prevent_initial_call=True)(insert_test_output)
+
+
+def get_page_caches_layout():
+    """
+    Returns the stores keeping the pages' content in the browser, which need
+    to outlive the pages and hence be part of the app's layout. Must be called
+    after the pages' callbacks have been added.
+
+    :returns: html.Div containing dcc.Stores
+    """
+    stores = [dcc.Store(id=store_id) for store_id in page_caches]
+    return html.Div(stores, style={'display': 'none'})
+
+
+def get_shared_content(id_preset, args, generation, get_content):
+    """
+    Returns a page's content from the fragment cache, computing and caching
+    it if it is missing. The content is cached serialized to plain JSON
+    values, which are served to all users as is. Content of older
+    generations is dropped.
+
+    :param id_preset: the page's id preset, see add_cached_content_callback
+    :param args: the inputs' and states' values (list)
+    :param generation: the current results generation (int)
+    :param get_content: function returning the content given args
+    :returns: the content, serialized (JSON values)
+    """
+    key = (id_preset, json.dumps(args), generation)
+    content = fragment_cache.get(key)
+    if content is None:
+        # Requests still seeing an older generation keep newer content
+        fragment_cache.delete_where(lambda k, _: k[2] < generation)
+        content = json.loads(json.dumps(get_content(*args),
+                                        cls=PlotlyJSONEncoder))
+        fragment_cache.set(key, content)
+    return content
+
+
+def get_cache_loaded_store(id_preset):
+    """
+    Returns the page-local store through which a page's kept content is
+    inserted, see add_cached_content_callback. It has to be rendered
+    together with the page's inputs, so that the callbacks inserting the
+    content never see only some of their inputs.
+
+    :param id_preset: the page's id preset, see add_cached_content_callback
+    :returns: dcc.Store
+    """
+    return dcc.Store(id=id_preset + '-cache-loaded')
+
+
+def add_cached_content_callback(id_preset, output, inputs, states,
+                                get_content, shared=False):
+    """
+    Adds a callback inserting a page's content, which get_content returns
+    given the inputs' and states' values. The content is kept in the browser
+    together with these values and the results generation (see
+    components/events.py). Until new test results or schedules arrive, the
+    kept content is inserted again in the browser (see assets/callbacks.js)
+    and the server does not look anything up but the generation.
+
+    The kept content and its key live in the app's layout (see
+    get_page_caches_layout), the page has to render the store returned by
+    get_cache_loaded_store together with its inputs. The server sets that
+    store to the key of the content to insert, which triggers the insertion.
+
+    :param id_preset: preset of the stores' ids, <preset>-cache,
+                      <preset>-cache-key and <preset>-cache-loaded
+    :param output: the dash.dependencies.Output to insert the content into
+    :param inputs: the callback's inputs (list of dash.dependencies.Input)
+    :param states: the callback's states (list of dash.dependencies.State)
+    :param get_content: function returning the content given the inputs'
+                        and states' values, may raise PreventUpdate
+    :param shared: whether the content is the same for all users, it is
+                   also cached in the server process then, see
+                   get_shared_content (optional, defaults to False)
+    """
+    content_id = id_preset + '-cache'
+    key_id = id_preset + '-cache-key'
+    page_caches.extend([content_id, key_id])
+
+    loaded_id = id_preset + '-cache-loaded'
+
+    def update_cache(*args):
+        args, key = list(args[:-1]), args[-1]
+        generation = get_generation()
+        new_key = {'generation': generation, 'args': args}
+        # The browser already has the content of the current generation
+        if key == new_key:
+            return [no_update, no_update, key]
+        if shared:
+            content = get_shared_content(id_preset, args, generation,
+                                         get_content)
+        else:
+            content = get_content(*args)
+        return [content, new_key, new_key]
+
+    # Only the small key is sent along with every request
+    app.callback([Output(content_id, 'data'), Output(key_id, 'data'),
+                  Output(loaded_id, 'data')],
+                 inputs, states + [State(key_id, 'data')])(update_cache)
+    app.clientside_callback(
+        ClientsideFunction('status_monitor', 'insert_cached_content'),
+        output,
+        [Input(loaded_id, 'data')],
+        [State(content_id, 'data'), State(key_id, 'data')]
+    )
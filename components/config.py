@@ -4,6 +4,81 @@ SQL_USER = 'user'
 SQL_PASSWORD = 'pw'
 SQL_DATABASE = 'db'
 
+# Months for which partitions of test_results are created in advance, if it
+# is partitioned (python3.7 -m components.sql partition)
+SQL_PARTITION_MONTHS_AHEAD = 3
+
+# Maximum number of database connections kept open per process
+SQL_POOL_SIZE = 10
+# Seconds to wait for a free pooled connection before giving up
+SQL_POOL_TIMEOUT = 30
+# Seconds after which an idle pooled connection is closed instead of reused
+SQL_POOL_MAX_IDLE = 300
+# Seconds of idleness after which a pooled connection is pinged before reuse
+SQL_POOL_PING_INTERVAL = 30
+
+# Number of sessions cached per web server process
+SESSION_CACHE_SIZE = 1024
+# Seconds a looked up session is cached before it is checked again
+SESSION_CACHE_TTL = 60
+
+# Number of rendered page fragments cached per web server process
+FRAGMENT_CACHE_SIZE = 64
+# Seconds a rendered page fragment is cached at most, fragments are also
+# dropped as soon as new test results or schedules arrive
+FRAGMENT_CACHE_TTL = 900
+
+# Maximum number of tests the test runner executes at once
+RUNNER_MAX_WORKERS = 32
+# Maximum number of tests the test runner executes at once on the same VM
+RUNNER_MAX_PER_VM = 4
+# Seconds a test may run before it is killed and recorded as failed
+RUNNER_TEST_TIMEOUT = 600
+# How the test runner executes tests, 'threads' or 'asyncio'
+RUNNER_ENGINE = 'threads'
+# Whether the test runner executes each VM's tests in a single python process
+RUNNER_BATCH = False
+# Number of tests executed at once by the single python process on a VM
+RUNNER_BATCH_JOBS = 1
+# Maximum number of test results the test runner writes at once
+RUNNER_WRITE_BATCH_SIZE = 500
+# Seconds a test result may wait for more results to be written with
+RUNNER_WRITE_FLUSH_INTERVAL = 5
+# Maximum number of characters of a test's output kept, the middle of longer
+# outputs is left out. Must fit test_outputs.output (mediumtext, 16 MB) at up
+# to 4 bytes per character, leaving room for the test runner's notes
+RUNNER_OUTPUT_CAP = 1024 * 1024
+# How the test runner reaches the VMs, 'ssh' or 'local' (runs the tests on
+# this host instead, for testing)
+RUNNER_TRANSPORT = 'ssh'
+# The ssh executable, can be pointed to a fake ssh for testing
+RUNNER_SSH_COMMAND = 'ssh'
+# Where ssh keeps the sockets of the persistent connections to the VMs
+RUNNER_SSH_CONTROL_PATH = '~/.ssh/status-monitor-%C'
+# How long idle persistent connections to the VMs are kept open
+RUNNER_SSH_CONTROL_PERSIST = '30m'
+
+# Where test outputs are stored, 'database' or 'segments' (compressed in
+# segment files on local disk, readable only on this host)
+OUTPUT_STORE = 'database'
+# Minimum number of characters of outputs stored in the segment files
+OUTPUT_STORE_MIN_SIZE = 4096
+# Directory containing the segment files
+OUTPUT_SEGMENTS_DIR = '/var/lib/status-monitor/segments'
+# Bytes from which a new segment file is started
+OUTPUT_SEGMENT_SIZE = 64 * 1024 * 1024
+
+# Days test results are kept before they are rolled up per hour
+RETENTION_RAW_DAYS = 8
+# Days hourly rollups are kept before they are rolled up per day
+RETENTION_HOURLY_DAYS = 90
+
+# Seconds between the web server's checks for new test results or schedules,
+# one query per process however many dashboards are open
+EVENTS_POLL_INTERVAL = 2
+# Seconds after which an idle event stream sends a keepalive comment
+EVENTS_KEEPALIVE = 30
+
 SERVER_DEBUG_MODE = True
 SERVER_HOST = '127.0.0.1'
 SERVER_PORT = 8050
@@ -0,0 +1,121 @@
+import json
+import pymysql
+import threading
+from time import sleep
+from flask import Response
+
+from app import app
+from components import auth
+from components.tests import get_results_generation
+from components.config import EVENTS_POLL_INTERVAL, EVENTS_KEEPALIVE
+
+
+class GenerationWatcher(object):
+    """
+    Watches the results generation (see
+    components.tests.bump_results_generation) from a background thread, so
+    that a web server process queries it once per interval however many
+    dashboards wait for it to change. The thread is started with the first
+    waiting dashboard.
+
+    Usage:
+        watcher = GenerationWatcher()
+        watcher.start()
+        generation = watcher.wait(generation, 30)
+    """
+
+    def __init__(self, interval=EVENTS_POLL_INTERVAL):
+        self.interval = interval
+        self.generation = None
+        self.thread = None
+        self.condition = threading.Condition()
+
+    def start(self):
+        """
+        Starts watching, unless already watching.
+        """
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.work, daemon=True)
+                self.thread.start()
+
+    def work(self):
+        """
+        Looks the generation up every interval and wakes up the waiting
+        dashboards when it changed.
+        """
+        while True:
+            try:
+                generation = get_results_generation()
+            except pymysql.err.Error as e:
+                print("[Server] Could not look up the results generation: {0}"
+                      .format(e))
+            else:
+                with self.condition:
+                    if generation != self.generation:
+                        self.generation = generation
+                        self.condition.notify_all()
+            sleep(self.interval)
+
+    def wait(self, generation, timeout):
+        """
+        Waits until the generation differs from given one or timeout passed.
+
+        :param generation: the generation known to the caller (int or None)
+        :param timeout: seconds to wait at most (int)
+        :returns: the current generation (int or None if not looked up yet)
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.generation not in [None, generation], timeout)
+            return self.generation
+
+
+watcher = GenerationWatcher()
+
+
+def get_generation():
+    """
+    Returns the current results generation, as last seen by the watcher if
+    it is running, otherwise looked up.
+
+    :returns: the generation (int)
+    """
+    generation = watcher.generation
+    if generation is None or not watcher.thread.is_alive():
+        return get_results_generation()
+    return generation
+
+
+def stream_generations():
+    """
+    Yields a server-sent event whenever the results generation changes,
+    starting with the current one, and keepalive comments in between.
+
+    :returns: generator of strings
+    """
+    generation = None
+    while True:
+        current = watcher.wait(generation, EVENTS_KEEPALIVE)
+        if current in [None, generation]:
+            yield ": keepalive\n\n"
+            continue
+        generation = current
+        yield "data: {0}\n\n".format(json.dumps({'generation': generation}))
+
+
+@app.server.route('/events')
+def events():
+    """
+    Notifies a dashboard of new test results or schedules as server-sent
+    events, see assets/callbacks.js. Unauthorized requests get no content,
+    which makes the browser stop reconnecting.
+
+    :returns: flask.Response
+    """
+    if not auth.is_authorized():
+        return Response(status=204)
+    watcher.start()
+    return Response(stream_generations(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
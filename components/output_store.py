@@ -0,0 +1,317 @@
+import os
+import mmap
+import time
+import zlib
+import fcntl
+import argparse
+import threading
+from itertools import repeat
+
+from components.sql import Cursor, WriteCursor
+from components.config import OUTPUT_STORE, OUTPUT_STORE_MIN_SIZE
+from components.config import OUTPUT_SEGMENTS_DIR, OUTPUT_SEGMENT_SIZE
+
+
+# Fraction of a segment's bytes no longer referenced from which compact
+# rewrites the segment
+COMPACT_MIN_GARBAGE = 0.5
+# Seconds since a segment's last append before compact may rewrite it, the
+# rows locating the appended outputs are committed only afterwards
+COMPACT_MIN_AGE = 3600
+
+
+class SegmentStore(object):
+    """
+    Stores test outputs compressed in append-only segment files on local
+    disk. An output is addressed by its segment, the offset in the segment
+    and its compressed length, which are kept in the test_outputs table. A
+    new segment is started once the current one reached segment_size bytes.
+    Appends are serialized across processes by a lock file, reads use
+    memory maps of the segments.
+
+    Usage:
+        store = SegmentStore()
+        segment, offset, length = store.append([b'...'])[0]
+        store.read(segment, offset, length)
+    """
+
+    def __init__(self, directory=OUTPUT_SEGMENTS_DIR,
+                 segment_size=OUTPUT_SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        # Memory maps of the segments read so far by segment
+        self.maps = {}
+        self.maps_lock = threading.Lock()
+
+    def get_path(self, segment):
+        """
+        Returns the path of a segment file.
+
+        :param segment: the segment's number (int)
+        :returns: the path (string)
+        """
+        return os.path.join(self.directory, '{0:08d}.seg'.format(segment))
+
+    def get_segments(self):
+        """
+        Returns the numbers of all existing segments.
+
+        :returns: list of ints, ordered
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        files = filter(lambda x: x.endswith('.seg') and x[:-4].isdigit(),
+                       os.listdir(self.directory))
+        return sorted(map(lambda x: int(x[:-4]), files))
+
+    def lock(self):
+        """
+        Returns the open lock file, locked exclusively. Closing it releases
+        the lock.
+
+        :returns: file object
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        f = open(os.path.join(self.directory, 'lock'), 'w')
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    def get_current_segment(self):
+        """
+        Returns the segment to append to, starting a new one if the last
+        segment is full. Must be called holding the lock.
+
+        :returns: the segment's number (int)
+        """
+        segments = self.get_segments()
+        if len(segments) == 0:
+            return 1
+        if os.path.getsize(self.get_path(segments[-1])) >= self.segment_size:
+            return segments[-1] + 1
+        return segments[-1]
+
+    def append_compressed(self, blobs):
+        """
+        Appends already compressed outputs to the current segment. Must be
+        called holding the lock.
+
+        :param blobs: the compressed outputs (list of bytes)
+        :returns: list of (segment, offset, length), one per blob
+        """
+        segment = self.get_current_segment()
+        locations = []
+        with open(self.get_path(segment), 'ab') as f:
+            offset = f.tell()
+            for blob in blobs:
+                locations.append((segment, offset, len(blob)))
+                offset += len(blob)
+            f.write(b''.join(blobs))
+            f.flush()
+            # The locations are committed to the database right after
+            os.fsync(f.fileno())
+        return locations
+
+    def append(self, outputs):
+        """
+        Compresses and appends outputs to the current segment.
+
+        :param outputs: the outputs (list of strings)
+        :returns: list of (segment, offset, length), one per output
+        """
+        blobs = [zlib.compress(output.encode('utf-8')) for output in outputs]
+        with self.lock():
+            return self.append_compressed(blobs)
+
+    def get_map(self, segment, end):
+        """
+        Returns a memory map of a segment covering at least end bytes,
+        remapping the segment if it has grown since it was mapped.
+
+        :param segment: the segment's number (int)
+        :param end: the number of bytes to cover (int)
+        :returns: mmap.mmap
+        """
+        with self.maps_lock:
+            m = self.maps.get(segment)
+            if m is None or len(m) < end:
+                with open(self.get_path(segment), 'rb') as f:
+                    m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                # Drop the maps of segments removed by compact meanwhile
+                for removed in [x for x in self.maps
+                                if not os.path.exists(self.get_path(x))]:
+                    del self.maps[removed]
+                self.maps[segment] = m
+            return m
+
+    def remove(self, segment):
+        """
+        Removes a segment and drops its memory map. Readers still using the
+        map keep it until they are done.
+
+        :param segment: the segment's number (int)
+        """
+        os.remove(self.get_path(segment))
+        with self.maps_lock:
+            self.maps.pop(segment, None)
+
+    def read_compressed(self, segment, offset, length):
+        """
+        Returns an output as stored in a segment.
+
+        :param segment: the segment's number (int)
+        :param offset: the output's offset in the segment (int)
+        :param length: the output's compressed length (int)
+        :returns: the compressed output (bytes)
+        """
+        return self.get_map(segment, offset + length)[offset:offset + length]
+
+    def read(self, segment, offset, length):
+        """
+        Returns an output stored in a segment.
+
+        :param segment: the segment's number (int)
+        :param offset: the output's offset in the segment (int)
+        :param length: the output's compressed length (int)
+        :returns: the output (string)
+        """
+        blob = self.read_compressed(segment, offset, length)
+        return zlib.decompress(blob).decode('utf-8')
+
+
+store = SegmentStore()
+
+
+def load_output(output, segment, offset, length):
+    """
+    Returns a test output given its columns of the test_outputs table.
+
+    :param output: the output if stored in the database (string or None)
+    :param segment: the output's segment if stored in the segment store
+                    (int or None)
+    :param offset: the output's offset in the segment (int or None)
+    :param length: the output's compressed length (int or None)
+    :returns: the output (string)
+    """
+    if segment is None:
+        return output
+    return store.read(segment, offset, length)
+
+
+def save_outputs(c, outputs):
+    """
+    Stores test outputs in the test_outputs table, skipping outputs stored
+    already. If OUTPUT_STORE is 'segments', outputs of at least
+    OUTPUT_STORE_MIN_SIZE characters are appended to the segment store and
+    only their location is stored in the database.
+
+    :param c: the cursor of the transaction to store the outputs in
+    :param outputs: the outputs by hash (dict, see
+                    components.tests.get_output_hash)
+    """
+    if len(outputs) == 0:
+        return
+    placeholders = ', '.join(repeat('%s', len(outputs)))
+    sql = "select hash from test_outputs where hash in ({0}){1};"
+    c.execute(sql.format(placeholders, ''), list(outputs))
+    stored = set(map(lambda x: x[0], c.fetchall()))
+    large, rows = [], []
+    for h, o in outputs.items():
+        if h in stored:
+            continue
+        if OUTPUT_STORE == 'segments' and len(o) >= OUTPUT_STORE_MIN_SIZE:
+            large.append((h, o))
+        else:
+            rows.append((h, o, None, None, None))
+    # Append before locking any rows, compact holds the store's lock while
+    # it updates rows
+    if len(large) > 0:
+        locations = store.append(list(map(lambda x: x[1], large)))
+        rows += [(h, None) + location
+                 for (h, _), location in zip(large, locations)]
+    # Lock the stored outputs until the transaction commits so that they are
+    # not removed as unused meanwhile, see components/retention.py
+    c.execute(sql.format(placeholders, ' lock in share mode'), list(outputs))
+    locked = set(map(lambda x: x[0], c.fetchall()))
+    # Outputs removed since they were looked up are stored in the database
+    rows += [(h, outputs[h], None, None, None) for h in stored - locked]
+    sql = """insert into test_outputs
+          (hash, output, segment, segment_offset, segment_length)
+          values ( %s, %s, %s, %s, %s )
+          on duplicate key update hash = hash;"""
+    c.executemany(sql, rows)
+
+
+def get_live_locations(segment):
+    """
+    Returns the locations of the outputs in a segment which are still
+    referenced from the test_outputs table.
+
+    :param segment: the segment's number (int)
+    :returns: list of (hash, offset, length)
+    """
+    with Cursor() as c:
+        sql = """select hash, segment_offset, segment_length
+              from test_outputs
+              where segment = %s
+              order by segment_offset;"""
+        c.execute(sql, (segment))
+        return c.fetchall()
+
+
+def compact():
+    """
+    Rewrites segments of which at least COMPACT_MIN_GARBAGE no longer is
+    referenced, e.g. after the outputs of old test results have been
+    removed. Copies the segment's live outputs to the current segment,
+    points the database to the copies and deletes the segment. Also removes
+    bytes appended by transactions that failed afterwards.
+
+    Segments appended to within COMPACT_MIN_AGE are skipped, since the rows
+    locating their latest outputs may not be committed yet. Must be run as
+    the user running the test runner, which owns the segments.
+    """
+    with store.lock():
+        segments = store.get_segments()
+        current = store.get_current_segment()
+        for segment in filter(lambda x: x != current, segments):
+            path = store.get_path(segment)
+            if time.time() - os.path.getmtime(path) < COMPACT_MIN_AGE:
+                continue
+            live = get_live_locations(segment)
+            size = os.path.getsize(path)
+            live_size = sum(map(lambda x: x[2], live))
+            if size == 0 or 1 - live_size / size < COMPACT_MIN_GARBAGE:
+                continue
+            blobs = [store.read_compressed(segment, offset, length)
+                     for _, offset, length in live]
+            locations = store.append_compressed(blobs)
+            with WriteCursor() as c:
+                sql = """update test_outputs
+                      set segment = %s, segment_offset = %s, segment_length = %s
+                      where hash = %s;"""
+                c.executemany(sql, [location + (h,) for (h, _, _), location
+                                    in zip(live, locations)])
+            # Keep the segment if rows locating outputs in it have been
+            # committed since its live outputs were looked up
+            if len(get_live_locations(segment)) > 0:
+                print("[Database] Kept segment {0}: outputs were added "
+                      "while compacting".format(segment))
+                continue
+            store.remove(segment)
+            print("[Database] Compacted segment {0}: {1} of {2} bytes live"
+                  .format(segment, live_size, size))
+            current = store.get_current_segment()
+
+
+# Commands available when running this module, e.g.
+# python3.7 -m components.output_store compact
+commands = {
+    'compact': compact
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the output store.")
+    parser.add_argument('command', choices=list(commands))
+    args = parser.parse_args()
+    commands[args.command]()
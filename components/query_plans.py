@@ -0,0 +1,95 @@
+import sys
+from datetime import datetime, timedelta
+
+from components.sql import Cursor
+from components.auth import SESSION_SQL
+from components.tests import LAST_TESTS_SQL, TEST_RESULT_SQL, TEST_HISTORY_SQL
+from components.tests import SCHEDULE_STATE_SQL
+
+
+# Tables growing with time or with the number of tests and vms, the hot
+# queries must not scan them completely
+GROWING_TABLES = ['test_results', 'test_outputs', 'test_results_hourly',
+                  'test_results_daily', 'latest_results', 'test_schedule',
+                  'sessions']
+
+# Access types of EXPLAIN meaning the whole table or index is read
+FULL_SCANS = ['ALL', 'index']
+
+
+def get_sample_test():
+    """
+    Returns a test and vm to use as query arguments, preferably existing ones
+    so that the optimizer sees realistic values.
+
+    :returns: test & vm (pair of strings, e.g. 'dns', 'vm01')
+    """
+    with Cursor() as c:
+        c.execute("select test, vm from run_on limit 1;")
+        row = c.fetchone()
+    return ('dns', 'vm01') if row is None else row
+
+
+def get_hot_queries():
+    """
+    Returns the queries run on (almost) every page load or runner loop along
+    with sample arguments.
+
+    :returns: list of (name, sql, args)
+    """
+    test, vm = get_sample_test()
+    week_ago = datetime.utcnow() - timedelta(days=7)
+    last_tests_sql = LAST_TESTS_SQL.format('%s', 'and latest_results.vm = %s')
+    return [('get_last_tests', last_tests_sql, (test, vm)),
+            ('get_test_result', TEST_RESULT_SQL, (test, vm, week_ago)),
+            ('get_test_history', TEST_HISTORY_SQL, (test, vm, week_ago) * 3),
+            ('get_schedule_state', SCHEDULE_STATE_SQL, ()),
+            ('lookup_session', SESSION_SQL, ('x' * 48))]
+
+
+def explain(sql, args):
+    """
+    Returns the query plan of a query.
+
+    :param sql: the query (string)
+    :param args: the query's arguments
+    :returns: list of plan rows as dicts, e.g. [{'table': 'sessions', ...}]
+    """
+    with Cursor() as c:
+        c.execute('explain ' + sql, args)
+        columns = list(map(lambda x: x[0], c.description))
+        return [dict(zip(columns, row)) for row in c.fetchall()]
+
+
+def get_full_scans(plan):
+    """
+    Returns the plan rows fully scanning one of the growing tables.
+
+    :param plan: the rows returned by explain
+    :returns: list of plan rows as dicts
+    """
+    return list(filter(lambda x: x['table'] in GROWING_TABLES
+                       and x['type'] in FULL_SCANS, plan))
+
+
+def check_query_plans():
+    """
+    Explains all hot queries and prints their access paths.
+
+    :returns: whether none of them fully scans a growing table (boolean)
+    """
+    success = True
+    for name, sql, args in get_hot_queries():
+        plan = explain(sql, args)
+        full_scans = get_full_scans(plan)
+        success = success and len(full_scans) == 0
+        for row in plan:
+            status = 'FULL SCAN' if row in full_scans else 'ok'
+            print("[Database] {0}: {1} {2} via {3} ({4})".format(
+                name, row['table'], row['type'], row['key'], status))
+    return success
+
+
+if __name__ == "__main__":
+    # Exit with an error if a hot query regressed to a full scan
+    sys.exit(0 if check_query_plans() else 1)
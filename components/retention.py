@@ -0,0 +1,218 @@
+import argparse
+from datetime import datetime, timedelta
+
+from components.sql import Cursor, WriteCursor, get_month_start
+from components.sql import get_partitions, create_partitions, drop_partition
+from components.config import RETENTION_RAW_DAYS, RETENTION_HOURLY_DAYS
+
+
+def get_cutoff(days, unit):
+    """
+    Returns the time before which data older than given days is rolled up,
+    aligned to the rollups' unit so that no hour or day is rolled up twice.
+
+    :param days: age of the data to roll up (int)
+    :param unit: 'hour' or 'day'
+    :returns: datetime.datetime
+    """
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    if unit == 'day':
+        return cutoff.replace(hour=0, minute=0, second=0, microsecond=0)
+    return cutoff.replace(minute=0, second=0, microsecond=0)
+
+
+# Rolls the results matching a condition ({0}) up per hour, updating
+# existing rollups as given ({1})
+ROLLUP_RESULTS_SQL = """insert into test_results_hourly
+                  (test, vm, hour, runs, passed, failed, min_ratio, max_ratio, first_failure_hash)
+              select test_results.test, test_results.vm,
+                  timestampadd(hour, timestampdiff(hour, '2000-01-01', test_results.date), '2000-01-01') as hour,
+                  count(*), sum(test_results.passed), sum(test_results.failed),
+                  min(test_results.passed / (test_results.passed + test_results.failed)),
+                  max(test_results.passed / (test_results.passed + test_results.failed)),
+                  substring_index(group_concat(
+                      if(test_results.failed > 0, output_hash, null) order by test_results.date), ',', 1)
+              from test_results
+              left join latest_results on test_results.test = latest_results.test
+                  and test_results.vm = latest_results.vm
+                  and test_results.date = latest_results.date
+              where {0}
+              group by test_results.test, test_results.vm, hour
+              on duplicate key update {1};"""
+
+# Adds rolled up results to existing rollups
+ADD_TO_ROLLUPS = """
+                  runs = test_results_hourly.runs + values(runs),
+                  passed = test_results_hourly.passed + values(passed),
+                  failed = test_results_hourly.failed + values(failed),
+                  min_ratio = least(test_results_hourly.min_ratio, values(min_ratio)),
+                  max_ratio = greatest(test_results_hourly.max_ratio, values(max_ratio)),
+                  first_failure_hash = coalesce(test_results_hourly.first_failure_hash, values(first_failure_hash))"""
+
+
+def rollup_raw_results(cutoff):
+    """
+    Aggregates the results older than cutoff into hourly rollups and removes
+    them from test_results. The latest result of each test on each vm is
+    kept, since latest_results points to it.
+
+    :param cutoff: time before which results are rolled up (datetime)
+    :returns: number of results removed (int)
+    """
+    condition = "test_results.date < %s and latest_results.test is null"
+    with WriteCursor() as c:
+        c.execute(ROLLUP_RESULTS_SQL.format(condition, ADD_TO_ROLLUPS),
+                  (cutoff))
+        # Remove exactly the rows rolled up above, in the same transaction
+        sql = """delete test_results from test_results
+              left join latest_results on test_results.test = latest_results.test
+                  and test_results.vm = latest_results.vm
+                  and test_results.date = latest_results.date
+              where {0};""".format(condition)
+        return c.execute(sql, (cutoff))
+
+
+def rollup_partition(start):
+    """
+    Aggregates the results of a month into hourly rollups and drops the
+    month's partition of test_results. The rolled up month is recorded in
+    the same transaction, so a rollup interrupted before dropping the
+    partition is not counted twice when repeated.
+
+    :param start: first day of the month (datetime.datetime)
+    :returns: number of results removed (int)
+    """
+    end = get_month_start(start, 1)
+    condition = "test_results.date >= %s and test_results.date < %s"
+    with WriteCursor() as c:
+        c.execute("select count(*) from test_results where {0};"
+                  .format(condition), (start, end))
+        results = c.fetchone()[0]
+        sql = """insert ignore into rolled_up_months
+              values ( %s );"""
+        # Only roll up if the month has not been rolled up before
+        if c.execute(sql, (start)) > 0:
+            c.execute(ROLLUP_RESULTS_SQL.format(condition, ADD_TO_ROLLUPS),
+                      (start, end))
+    drop_partition(start)
+    return results
+
+
+def has_latest_results(start):
+    """
+    Returns whether the latest result of a test on a vm is from given month.
+
+    :param start: first day of the month (datetime.datetime)
+    :returns: boolean
+    """
+    with Cursor() as c:
+        sql = """select count(*) from latest_results
+              where date >= %s and date < %s;"""
+        c.execute(sql, (start, get_month_start(start, 1)))
+        return c.fetchone()[0] > 0
+
+
+def rollup_partitions(cutoff):
+    """
+    Rolls up the months of a partitioned test_results which ended before
+    cutoff and drops their partitions, which is much faster than deleting
+    their results. Months containing latest results can not be dropped,
+    their other results are deleted instead. Also creates the partitions of
+    the upcoming months.
+
+    :param cutoff: time before which results are rolled up (datetime)
+    :returns: number of results removed (int)
+    """
+    create_partitions()
+    results = 0
+    for start in get_partitions():
+        if get_month_start(start, 1) > cutoff:
+            break
+        if has_latest_results(start):
+            results += rollup_raw_results(get_month_start(start, 1))
+        else:
+            results += rollup_partition(start)
+    return results
+
+
+def rollup_hourly_results(cutoff):
+    """
+    Aggregates the hourly rollups older than cutoff into daily rollups and
+    removes them.
+
+    :param cutoff: time before which hourly rollups are rolled up (datetime)
+    :returns: number of hourly rollups removed (int)
+    """
+    with WriteCursor() as c:
+        sql = """insert into test_results_daily
+                  (test, vm, day, runs, passed, failed, min_ratio, max_ratio, first_failure_hash)
+              select test, vm, date(hour) as day,
+                  sum(runs), sum(passed), sum(failed), min(min_ratio), max(max_ratio),
+                  substring_index(group_concat(first_failure_hash order by hour), ',', 1)
+              from test_results_hourly
+              where hour < %s
+              group by test, vm, day
+              on duplicate key update
+                  runs = test_results_daily.runs + values(runs),
+                  passed = test_results_daily.passed + values(passed),
+                  failed = test_results_daily.failed + values(failed),
+                  min_ratio = least(test_results_daily.min_ratio, values(min_ratio)),
+                  max_ratio = greatest(test_results_daily.max_ratio, values(max_ratio)),
+                  first_failure_hash = coalesce(test_results_daily.first_failure_hash, values(first_failure_hash));"""
+        c.execute(sql, (cutoff))
+        sql = """delete from test_results_hourly
+              where hour < %s;"""
+        return c.execute(sql, (cutoff))
+
+
+def remove_unused_outputs():
+    """
+    Removes the outputs neither referenced by a test result nor by a rollup.
+    Outputs in the segment store are removed from the database only, use
+    python3.7 -m components.output_store compact to reclaim their space.
+
+    :returns: number of outputs removed (int)
+    """
+    with WriteCursor() as c:
+        sql = """delete test_outputs from test_outputs
+              left join test_results on test_outputs.hash = test_results.output_hash
+              left join test_results_hourly on test_outputs.hash = test_results_hourly.first_failure_hash
+              left join test_results_daily on test_outputs.hash = test_results_daily.first_failure_hash
+              where test_results.output_hash is null
+              and test_results_hourly.first_failure_hash is null
+              and test_results_daily.first_failure_hash is null;"""
+        return c.execute(sql)
+
+
+def rollup():
+    """
+    Applies the retention policy: results older than RETENTION_RAW_DAYS are
+    rolled up per hour, hourly rollups older than RETENTION_HOURLY_DAYS per
+    day. Daily rollups are kept. If test_results is partitioned, results are
+    rolled up once their whole month is older than RETENTION_RAW_DAYS.
+    Safe to run repeatedly, e.g. by cron.
+    """
+    cutoff = get_cutoff(RETENTION_RAW_DAYS, 'hour')
+    # Partitioned results are rolled up per month, see rollup_partitions
+    if get_partitions() is None:
+        results = rollup_raw_results(cutoff)
+    else:
+        results = rollup_partitions(cutoff)
+    hours = rollup_hourly_results(get_cutoff(RETENTION_HOURLY_DAYS, 'day'))
+    outputs = remove_unused_outputs()
+    print("[Database] Rolled up {0} results and {1} hourly rollups, removed "
+          "{2} unused outputs".format(results, hours, outputs))
+
+
+# Commands available when running this module, e.g.
+# python3.7 -m components.retention rollup
+commands = {
+    'rollup': rollup
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply the retention policy.")
+    parser.add_argument('command', choices=list(commands))
+    args = parser.parse_args()
+    commands[args.command]()
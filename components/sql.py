@@ -1,13 +1,203 @@
+import os
+import time
+import argparse
 import pymysql
+import threading
+import importlib.util
+from datetime import datetime
 
 from components.config import *
 
 
+# Errors after which a connection can not be trusted anymore
+CONNECTION_ERRORS = (pymysql.err.OperationalError, pymysql.err.InterfaceError)
+
+
+class ConnectionPool(object):
+    """
+    A bounded, thread-safe pool of database connections.
+
+    Connections are opened lazily, at most size of them at once. Borrowers
+    wait up to timeout seconds for a free connection. Connections idle for
+    longer than ping_interval seconds are pinged before being handed out
+    again, those idle for longer than max_idle seconds are closed.
+
+    Usage:
+        db = pool.acquire()
+        ...
+        pool.release(db)
+    """
+
+    def __init__(self, size=SQL_POOL_SIZE, timeout=SQL_POOL_TIMEOUT,
+                 max_idle=SQL_POOL_MAX_IDLE,
+                 ping_interval=SQL_POOL_PING_INTERVAL, **connect_args):
+        self.size = size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.ping_interval = ping_interval
+        self.connect_args = connect_args
+        self.condition = threading.Condition()
+        # Idle connections as (connection, time returned), oldest first
+        self.idle = []
+        self.in_use = 0
+        # Statistics, see stats()
+        self.created = 0
+        self.discarded = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def acquire(self):
+        """
+        Borrows a connection from the pool, opening a new one if none is idle
+        and the pool is not exhausted yet.
+
+        :returns: an open connection (pymysql.connections.Connection)
+        :raises pymysql.err.OperationalError: if no connection became
+                                              available within timeout
+        """
+        start = time.monotonic()
+        with self.condition:
+            expired = self.pop_expired(start)
+            waited = False
+            while len(self.idle) == 0 and self.in_use >= self.size:
+                remaining = start + self.timeout - time.monotonic()
+                if remaining <= 0:
+                    raise pymysql.err.OperationalError(
+                        "Timed out waiting for a pooled database connection")
+                waited = True
+                self.condition.wait(remaining)
+            if waited:
+                self.waits += 1
+                self.wait_time += time.monotonic() - start
+            # Reuse the most recently returned connection, it is the
+            # least likely to have been dropped by the server
+            db, since = self.idle.pop() if len(self.idle) > 0 else (None, 0)
+            self.in_use += 1
+        self.close_all(expired)
+        try:
+            if db is not None and not self.is_healthy(db, since):
+                self.close_all([db])
+                db = None
+            if db is None:
+                db = pymysql.connect(**self.connect_args)
+                with self.condition:
+                    self.created += 1
+        except Exception:
+            self.release(None, discard=True)
+            raise
+        return db
+
+    def release(self, db, discard=False):
+        """
+        Returns a borrowed connection to the pool.
+
+        :param db: the connection returned by acquire()
+        :param discard: close the connection instead of reusing it (boolean)
+        """
+        with self.condition:
+            self.in_use -= 1
+            if not discard:
+                self.idle.append((db, time.monotonic()))
+            self.condition.notify()
+        if discard and db is not None:
+            self.close_all([db])
+
+    def is_healthy(self, db, since):
+        """
+        Checks whether an idle connection can be reused. Only pings the
+        server if the connection has been idle for a while.
+
+        :param db: the idle connection
+        :param since: time the connection was returned (time.monotonic())
+        :returns: whether the connection is usable (boolean)
+        """
+        if time.monotonic() - since < self.ping_interval:
+            return True
+        try:
+            db.ping(reconnect=True)
+            return True
+        except pymysql.err.Error:
+            return False
+
+    def pop_expired(self, now):
+        """
+        Removes the connections idle for longer than max_idle from the pool.
+        Must be called with the condition held.
+
+        :param now: the current time (time.monotonic())
+        :returns: the removed connections (list)
+        """
+        n_expired = len(list(filter(lambda x: now - x[1] > self.max_idle,
+                                    self.idle)))
+        expired = [db for db, _ in self.idle[:n_expired]]
+        self.idle = self.idle[n_expired:]
+        return expired
+
+    def close_all(self, connections):
+        """
+        Closes the given connections, ignoring already broken ones.
+
+        :param connections: connections to close (list)
+        """
+        for db in connections:
+            try:
+                db.close()
+            except pymysql.err.Error:
+                pass
+        with self.condition:
+            self.discarded += len(connections)
+
+    def stats(self):
+        """
+        Returns the pool's current usage and statistics.
+
+        :returns: dict, e.g. {'size': 10, 'in_use': 2, 'idle': 3, ...}
+        """
+        with self.condition:
+            return {'size': self.size,
+                    'in_use': self.in_use,
+                    'idle': len(self.idle),
+                    'created': self.created,
+                    'discarded': self.discarded,
+                    'waits': self.waits,
+                    'wait_time': self.wait_time}
+
+
+# One pool per set of connection arguments, created on first use
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(**connect_args):
+    """
+    Returns the connection pool for the given connection arguments.
+
+    :param connect_args: keyword arguments for pymysql.connect
+    :returns: ConnectionPool
+    """
+    key = tuple(sorted(connect_args.items()))
+    with pools_lock:
+        if key not in pools:
+            pools[key] = ConnectionPool(**connect_args)
+        return pools[key]
+
+
+def get_pool_stats():
+    """
+    Returns usage statistics of the default connection pool.
+
+    :returns: dict with in_use, idle, waits, wait_time (seconds), ...
+    """
+    return get_pool(host=SQL_HOST, user=SQL_USER, password=SQL_PASSWORD,
+                    database=SQL_DATABASE).stats()
+
+
 class Cursor(object):
     """
     Returns a database read-only cursor for use in with statements.
 
-    This is a read-only cursor, changes are not committed.
+    This is a read-only cursor, changes are not committed. The connection is
+    borrowed from a connection pool and returned to it afterwards.
 
     Usage:
         with Cursor() as c:
@@ -16,24 +206,48 @@ class Cursor(object):
 
     def __init__(self, host=SQL_HOST, port=SQL_PORT, user=SQL_USER,
                  password=SQL_PASSWORD, db=SQL_DATABASE):
-        self.db = pymysql.connect(
-            host=host,
-            user=user,
-            password=password,
-            database=db)
+        self.pool = get_pool(host=host, user=user, password=password,
+                             database=db)
+        self.db = None
 
     def __enter__(self):
+        self.db = self.pool.acquire()
         return self.db.cursor()
 
     def __exit__(self, exc_type, exc_val, trace):
-        self.db.close()
+        # Rolling back ends the transaction, otherwise the next borrower
+        # would read from this transaction's (outdated) snapshot
+        self.release(self.db.rollback, exc_type)
+
+    def release(self, end_transaction, exc_type):
+        """
+        Ends the transaction and returns the connection to the pool. Broken
+        connections are discarded so the next borrower reconnects.
+
+        :param end_transaction: function ending the transaction
+        :param exc_type: type of exception raised in the with block or None
+        """
+        discard = exc_type is not None and issubclass(exc_type,
+                                                      CONNECTION_ERRORS)
+        try:
+            if not discard:
+                end_transaction()
+        except pymysql.err.Error:
+            discard = True
+            # Do not hide the exception raised in the with block
+            if exc_type is None:
+                raise
+        finally:
+            self.pool.release(self.db, discard)
+            self.db = None
 
 
 class WriteCursor(Cursor):
     """
     Returns a database cursor for use in with statements.
 
-    Will commit changes made using the cursor.
+    Will commit changes made using the cursor, unless an exception is raised
+    in the with block. Changes are rolled back in that case.
 
     Usage:
         with Cursor() as c:
@@ -41,8 +255,8 @@ class WriteCursor(Cursor):
     """
 
     def __exit__(self, exc_type, exc_val, trace):
-        self.db.commit()
-        super().__exit__(exc_type, exc_val, trace)
+        end_transaction = self.db.commit if exc_type is None else self.db.rollback
+        self.release(end_transaction, exc_type)
 
 
 def flatten_results(results):
@@ -124,6 +338,19 @@ def setup_database():
                 foreign key (vm) references vms (vm)
               );"""
         c.execute(sql)
+        # Create the table containing the last result of each test on each
+        # vm, (test, date, vm) points to the full result in test_results
+        sql = """create table if not exists latest_results (
+                test varchar(48),
+                vm varchar(8),
+                passed tinyint not null,
+                failed tinyint not null,
+                date datetime not null,
+                primary key (test, vm),
+                foreign key (test) references weeks (test),
+                foreign key (vm) references vms (vm)
+              );"""
+        c.execute(sql)
         # Create the table containing the test schedule
         sql = """create table if not exists test_schedule (
               by_user varchar(48),
@@ -136,5 +363,228 @@ def setup_database():
         c.execute(sql)
 
 
-if __name__ == "__main__":
+def backfill_latest_results():
+    """
+    Fills the latest_results table from test_results, e.g. after upgrading
+    an existing database. Safe to run repeatedly.
+    """
+    with WriteCursor() as c:
+        sql = """insert into latest_results (test, vm, passed, failed, date)
+              select test_results.test, test_results.vm, passed, failed, test_results.date
+              from test_results
+              inner join (
+                  select test, vm, max(date) as date
+                  from test_results
+                  group by test, vm
+              ) last_results on test_results.test = last_results.test
+                  and test_results.vm = last_results.vm
+                  and test_results.date = last_results.date
+              on duplicate key update
+                  passed = if(values(date) >= latest_results.date, values(passed), latest_results.passed),
+                  failed = if(values(date) >= latest_results.date, values(failed), latest_results.failed),
+                  date = greatest(values(date), latest_results.date);"""
+        c.execute(sql)
+
+
+def get_month_start(date, months=0):
+    """
+    Returns the first day of the month months after the month of a date.
+
+    :param date: the date (datetime.datetime)
+    :param months: number of months to add (int, optional)
+    :returns: datetime.datetime, e.g. datetime(2020, 3, 1)
+    """
+    month = date.year * 12 + date.month - 1 + months
+    return datetime(month // 12, month % 12 + 1, 1)
+
+
+def get_partition_definition(start):
+    """
+    Returns the definition of the partition of test_results containing the
+    results of the month starting at start.
+
+    :param start: first day of the month (datetime.datetime)
+    :returns: the definition (string)
+    """
+    return "partition p{0} values less than (to_days('{1}'))".format(
+        start.strftime('%Y%m'), get_month_start(start, 1).strftime('%Y-%m-%d'))
+
+
+def get_partitions():
+    """
+    Returns the monthly partitions of test_results.
+
+    :returns: first days of the partitions' months (list of datetimes,
+              ordered), None if test_results is not partitioned
+    """
+    with Cursor() as c:
+        sql = """select partition_name from information_schema.partitions
+              where table_schema = database() and table_name = 'test_results'
+              and partition_name is not null
+              order by partition_ordinal_position;"""
+        c.execute(sql)
+        names = flatten_results(c.fetchall())
+    if 'pmax' not in names:
+        return None
+    return [datetime.strptime(n[1:], '%Y%m') for n in names if n != 'pmax']
+
+
+def partition_test_results():
+    """
+    Partitions test_results by month, making it possible to remove a
+    month's results by dropping its partition, see components/retention.py.
+    Partitioned tables can not have foreign keys, so the foreign keys of
+    test_results are dropped. Rebuilds the table, which can take a while.
+    """
+    if get_partitions() is not None:
+        print("[Database] test_results is partitioned already")
+        return
+    with WriteCursor() as c:
+        sql = """select constraint_name from information_schema.referential_constraints
+              where constraint_schema = database() and table_name = 'test_results';"""
+        c.execute(sql)
+        for name in flatten_results(c.fetchall()):
+            c.execute("alter table test_results drop foreign key {0};"
+                      .format(name))
+        c.execute("select min(date) from test_results;")
+        first = c.fetchone()[0] or datetime.utcnow()
+        start, last = get_month_start(first), get_month_start(
+            datetime.utcnow(), SQL_PARTITION_MONTHS_AHEAD)
+        partitions = []
+        while start <= last:
+            partitions.append(get_partition_definition(start))
+            start = get_month_start(start, 1)
+        # Catches results beyond the last month, should stay empty
+        partitions.append("partition pmax values less than maxvalue")
+        c.execute("""alter table test_results
+                  partition by range (to_days(date)) ({0});"""
+                  .format(', '.join(partitions)))
+    print("[Database] Partitioned test_results into {0} months"
+          .format(len(partitions) - 1))
+
+
+def create_partitions():
+    """
+    Creates the partitions of test_results for the next
+    SQL_PARTITION_MONTHS_AHEAD months if test_results is partitioned.
+    """
+    partitions = get_partitions()
+    if partitions is None:
+        return
+    start = get_month_start(partitions[-1], 1)
+    last = get_month_start(datetime.utcnow(), SQL_PARTITION_MONTHS_AHEAD)
+    definitions = []
+    while start <= last:
+        definitions.append(get_partition_definition(start))
+        start = get_month_start(start, 1)
+    if len(definitions) == 0:
+        return
+    with WriteCursor() as c:
+        c.execute("""alter table test_results reorganize partition pmax into
+                  ({0}, partition pmax values less than maxvalue);"""
+                  .format(', '.join(definitions)))
+
+
+def drop_partition(start):
+    """
+    Removes all results of a month from test_results by dropping the
+    month's partition.
+
+    :param start: first day of the month (datetime.datetime)
+    """
+    with WriteCursor() as c:
+        c.execute("alter table test_results drop partition p{0};"
+                  .format(start.strftime('%Y%m')))
+
+
+# Directory containing the migrations, see get_migrations
+MIGRATIONS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+
+def get_migrations():
+    """
+    Returns the available migrations ordered by version.
+
+    Migrations are python files in MIGRATIONS_DIR named
+    <version>_<description>.py, e.g. 0001_test_results_indexes.py. Each
+    defines a function up(c) applying the migration using the cursor c.
+
+    :returns: list of (version, name, path), e.g.
+              [(1, '0001_test_results_indexes', '/.../0001_....py')]
+    """
+    files = sorted(filter(lambda x: x[0].isdigit() and x.endswith('.py'),
+                          os.listdir(MIGRATIONS_DIR)))
+    return [(int(f.split('_')[0]), f[:-3], os.path.join(MIGRATIONS_DIR, f))
+            for f in files]
+
+
+def get_schema_version():
+    """
+    Returns the version of the last migration applied to the database.
+
+    :returns: version (int, 0 if no migration has been applied)
+    """
+    with Cursor() as c:
+        c.execute("select coalesce(max(version), 0) from schema_version;")
+        return c.fetchone()[0]
+
+
+def migrate():
+    """
+    Applies all migrations newer than the database's schema version in order
+    and records their versions. Migrations can only be applied, not undone.
+
+    Note that MySQL commits schema changes immediately, a failing migration
+    has to be fixed up manually before migrating again.
+    """
+    with WriteCursor() as c:
+        sql = """create table if not exists schema_version (
+                version int,
+                name varchar(128) not null,
+                applied datetime not null,
+                primary key (version)
+              );"""
+        c.execute(sql)
+    version = get_schema_version()
+    for migration, name, path in get_migrations():
+        if migration <= version:
+            continue
+        print("[Database] Applying migration {0}".format(name))
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        with WriteCursor() as c:
+            module.up(c)
+            sql = """insert into schema_version
+                  values ( %s, %s, utc_timestamp() );"""
+            c.execute(sql, (migration, name))
+    print("[Database] Schema is at version {0}".format(get_schema_version()))
+
+
+def setup_and_migrate():
+    """
+    Creates the necessary tables if they don't exist and applies all
+    pending migrations.
+    """
     setup_database()
+    migrate()
+
+
+# Commands available when running this module, e.g.
+# python3.7 -m components.sql backfill-latest
+commands = {
+    'setup': setup_and_migrate,
+    'migrate': migrate,
+    'backfill-latest': backfill_latest_results,
+    'partition': partition_test_results,
+    'create-partitions': create_partitions
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the database.")
+    parser.add_argument('command', nargs='?', default='setup',
+                        choices=list(commands))
+    args = parser.parse_args()
+    commands[args.command]()
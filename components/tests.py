@@ -1,6 +1,8 @@
+import hashlib
 from itertools import repeat
-from datetime import datetime
+from datetime import datetime, timedelta
 from components.sql import WriteCursor, Cursor, flatten_results
+from components.output_store import load_output
 
 
 def get_all_weeks():
@@ -32,7 +34,7 @@ def get_tests_in_week(week):
     with Cursor() as c:
         sql = """select distinct weeks.test from (select * from weeks order by week, week_num) weeks
               inner join run_on on weeks.test = run_on.test
-              inner join test_results on weeks.test = test_results.test and run_on.vm = test_results.vm
+              inner join latest_results on weeks.test = latest_results.test and run_on.vm = latest_results.vm
               where weeks.week = %s;"""
         c.execute(sql, (week))
         tests = c.fetchall()
@@ -50,7 +52,7 @@ def get_all_vms():
     with Cursor() as c:
         sql = """select distinct vms.vm from vms
               inner join run_on on vms.vm = run_on.vm
-              inner join test_results on vms.vm = test_results.vm
+              inner join latest_results on vms.vm = latest_results.vm
               order by vms.vm ASC;"""
         c.execute(sql)
         tests = c.fetchall()
@@ -68,10 +70,10 @@ def get_tests_of_vm(vm):
     :returns: list of weeks & tests (list of pairs, e.g. [[3, 'dns']])
     """
     with Cursor() as c:
-        sql = """select distinct weeks.week, test_results.test from test_results
-              inner join run_on on test_results.vm = run_on.vm and test_results.test = run_on.test
-              inner join weeks on test_results.test = weeks.test
-              where test_results.vm = %s
+        sql = """select distinct weeks.week, latest_results.test from latest_results
+              inner join run_on on latest_results.vm = run_on.vm and latest_results.test = run_on.test
+              inner join weeks on latest_results.test = weeks.test
+              where latest_results.vm = %s
               order by weeks.week ASC;"""
         c.execute(sql, (vm))
         return c.fetchall()
@@ -86,10 +88,10 @@ def get_vms_of_test(test):
     :returns: list of vms (list of strings, e.g. ['vm01', 'vm02'])
     """
     with Cursor() as c:
-        sql = """select distinct test_results.vm from test_results
-              inner join run_on on test_results.vm = run_on.vm and test_results.test = run_on.test
+        sql = """select distinct latest_results.vm from latest_results
+              inner join run_on on latest_results.vm = run_on.vm and latest_results.test = run_on.test
               where run_on.test = %s
-              order by test_results.vm ASC;"""
+              order by latest_results.vm ASC;"""
         c.execute(sql, (test))
         return flatten_results(c.fetchall())
 
@@ -105,67 +107,182 @@ def get_tests_names_of_vm(vm):
     return list(map(lambda x: x[1], get_tests_of_vm(vm)))
 
 
-def get_last_test(test, vm='%'):
+# The results of a test on a vm since a given time, older results are
+# rolled up per hour or day (see components/retention.py)
+TEST_HISTORY_SQL = """select 'result', passed, failed, date, 1,
+                  output, segment, segment_offset, segment_length
+              from test_results
+              inner join test_outputs on test_results.output_hash = test_outputs.hash
+              where test = %s and vm = %s and date >= %s
+              union all
+              select 'hour', passed, failed, hour, runs,
+                  output, segment, segment_offset, segment_length
+              from test_results_hourly
+              left join test_outputs on test_results_hourly.first_failure_hash = test_outputs.hash
+              where test = %s and vm = %s and hour >= %s
+              union all
+              select 'day', passed, failed, day, runs,
+                  output, segment, segment_offset, segment_length
+              from test_results_daily
+              left join test_outputs on test_results_daily.first_failure_hash = test_outputs.hash
+              where test = %s and vm = %s and day >= date(%s)
+              order by 4 DESC;"""
+
+
+def get_history_output(kind, runs, output):
+    """
+    Returns the output to show for an entry of a test's history.
+
+    :param kind: the entry's kind, 'result' or the rollup's unit 'hour' or
+                 'day'
+    :param runs: number of test results in the entry (int)
+    :param output: the entry's output, of the first failing run for rollups
+                   (string or None)
+    :returns: the output (string)
     """
-    Returns the results of the last run of a given test.
+    if kind == 'result':
+        return output
+    summary = "[Rollup] {0} runs in this {1}".format(runs, kind)
+    if output is None:
+        return summary
+    return summary + "\nFirst failure:\n" + output
 
-    :param test: test to get results for (string, e.g. 'dns')
-    :param vm: limit to results on this vm (string, e.g. 'vm01')
-    :returns: results as dict if there are any, e.g. {'passed': 2, ...},
-              None otherwise
+
+def get_test_history(test, vm, days=7):
     """
+    Returns all test results of the last days from given test run on given
+    vm. Results older than RETENTION_RAW_DAYS are returned as rollups per
+    hour or day, summing the passed and failed checks of their runs.
+
+    :param test: test's name (string, e.g. 'dns')
+    :param vm: vm's name (string, e.g. 'vm01')
+    :param days: number of days to return results of (int, optional)
+    """
+    since = datetime.utcnow() - timedelta(days=days)
     with Cursor() as c:
-        # test_results.vm like %s works since default value for arg vm is '%'
-        sql = """select passed, failed, output, date, test_results.vm
+        c.execute(TEST_HISTORY_SQL, (test, vm, since) * 3)
+        tests = c.fetchall()
+    return {'passed': list(map(lambda x: x[1], tests)),
+            'failed': list(map(lambda x: x[2], tests)),
+            'quota': list(map(lambda x: x[1] / (x[1] + x[2]), tests)),
+            'runs': list(map(lambda x: x[4], tests)),
+            'output': list(map(lambda x: get_history_output(
+                x[0], x[4], load_output(*x[5:])), tests)),
+            'date': list(map(lambda x: x[3], tests))}
+
+
+# A single result of a test on a vm
+TEST_RESULT_SQL = """select passed, failed, output, segment, segment_offset, segment_length,
+                  date, vm
               from test_results
-              inner join run_on on test_results.vm = run_on.vm
-              where test_results.test = %s and test_results.vm like %s
-              order by date DESC
-              limit 1;"""
-        c.execute(sql, (test, vm))
-        row = c.fetchone()
-        # If row is None, now results exist for specified arguments
-        if row is None:
-            return None
-        passed, failed, output, date, vm = row
-    return {'passed': passed, 'failed': failed,
-            'output': output, 'date': date, 'vm': vm}
+              inner join test_outputs on test_results.output_hash = test_outputs.hash
+              where test = %s and vm = %s and date = %s;"""
 
 
-def get_test_history(test, vm):
+def get_test_result(test, vm, date):
     """
-    Returns all test results of the last week from given test run on given vm.
+    Returns a single result of a test including its output, e.g. one
+    returned by get_last_tests.
 
     :param test: test's name (string, e.g. 'dns')
     :param vm: vm's name (string, e.g. 'vm01')
+    :param date: the time the test finished (datetime.datetime or isoformat
+                 string)
+    :returns: results as dict if the result exists, e.g. {'passed': 2, ...},
+              None otherwise
     """
+    if isinstance(date, str):
+        date = datetime.fromisoformat(date)
     with Cursor() as c:
-        sql = """select passed, failed, output, date
-              from test_results
-              where test = %s and vm = %s
-              and date >= subdate(utc_timestamp(), interval 7 day)
-              order by date DESC;"""
-        c.execute(sql, (test, vm))
-        tests = c.fetchall()
-    return {'passed': list(map(lambda x: x[0], tests)),
-            'failed': list(map(lambda x: x[1], tests)),
-            'quota': list(map(lambda x: x[0] / (x[0] + x[1]), tests)),
-            'output': list(map(lambda x: x[2], tests)),
-            'date': list(map(lambda x: x[3], tests))}
+        c.execute(TEST_RESULT_SQL, (test, vm, date))
+        row = c.fetchone()
+    if row is None:
+        return None
+    passed, failed, output, segment, offset, length, date, vm = row
+    return {'passed': passed, 'failed': failed,
+            'output': load_output(output, segment, offset, length),
+            'date': date, 'vm': vm}
+
+
+def get_output_hash(output):
+    """
+    Returns the key under which a test output is stored in the test_outputs
+    table. Identical outputs are stored only once.
+
+    :param output: the test output (string)
+    :returns: the output's SHA-256 hash (string of 64 hex digits)
+    """
+    return hashlib.sha256(output.encode('utf-8')).hexdigest()
+
+
+# The latest results of the tests matching placeholders ({0}), optionally
+# limited to a vm ({1}), see get_last_tests
+LAST_TESTS_SQL = """select latest_results.test, latest_results.passed, latest_results.failed,
+                  latest_results.date, latest_results.vm
+              from latest_results
+              inner join run_on on latest_results.test = run_on.test
+                  and latest_results.vm = run_on.vm
+              where latest_results.test in ({0}) {1};"""
+
+
+def get_last_tests(tests, vm=None):
+    """
+    Returns the results of the last run of the given tests on every vm they
+    ran on, without their outputs (see get_test_result). Uses a single query
+    on the latest_results table regardless of the number of tests.
+
+    :param tests: tests to get results for (list of strings, e.g. ['dns'])
+    :param vm: limit to results on this vm (string, e.g. 'vm01', optional)
+    :returns: results by test & vm (dict, e.g.
+              {('dns', 'vm01'): {'passed': 2, ...}})
+    """
+    if len(tests) == 0:
+        return {}
+    placeholders = ', '.join(repeat('%s', len(tests)))
+    vm_condition = '' if vm is None else 'and latest_results.vm = %s'
+    args = list(tests) + ([] if vm is None else [vm])
+    with Cursor() as c:
+        c.execute(LAST_TESTS_SQL.format(placeholders, vm_condition), args)
+        rows = c.fetchall()
+    return {(test, vm): {'passed': passed, 'failed': failed,
+                         'date': date, 'vm': vm}
+            for test, passed, failed, date, vm in rows}
+
 
+def pick_last_test(last_tests, test, vm=None):
+    """
+    Picks the results of one test from the results of get_last_tests.
 
-def summarize_tests(tests, vm='%'):
+    :param last_tests: results returned by get_last_tests (dict)
+    :param test: test to pick results of (string, e.g. 'dns')
+    :param vm: vm to pick results on (string, e.g. 'vm01', optional,
+               defaults to the last run on any vm)
+    :returns: results as dict if there are any, e.g. {'passed': 2, ...},
+              None otherwise
+    """
+    if vm is not None:
+        return last_tests.get((test, vm))
+    results = [r for (t, _), r in last_tests.items() if t == test]
+    return max(results, key=lambda x: x['date'], default=None)
+
+
+def summarize_tests(tests, vm=None, last_tests=None):
     """
     Summarises a list of tests by looking up the results of their last
     execution and returning the number of (completely) passed and failed
     tests among them.
 
     :param tests: list of tests (list of strings, e.g. ['dns', 'dhcp'])
+    :param vm: limit to results on this vm (string, e.g. 'vm01', optional)
+    :param last_tests: results returned by get_last_tests (optional, looked
+                       up if not given)
     :returns: number of passed & failed tests (pair of ints, e.g. 5, 0)
     """
     # Get the tests' results
-    vm = repeat(vm, len(tests))
-    results = list(filter(None, map(get_last_test, tests, vm)))
+    if last_tests is None:
+        last_tests = get_last_tests(tests, vm)
+    results = list(filter(None, map(lambda x: pick_last_test(last_tests, x, vm),
+                                    tests)))
     # Extract how many of them did not fail any check -> passed tests
     passed = len(list(filter(lambda x: x['failed'] == 0, results)))
     # The number of failed tests is (# of all tests) - (# of passed tests)
@@ -173,45 +290,59 @@ def summarize_tests(tests, vm='%'):
     return passed, failed
 
 
-def next_tests_scheduled():
+def get_next_slot(start, interval, after=None):
     """
-    Returns the next time for which a test is scheduled.
-
-    :returns: time (datetime.dateime) or None if no tests are scheduled
+    Returns the first slot of a recurring schedule strictly after given time.
+    The schedule's slots are start, start + interval, start + 2 * interval...
+
+    :param start: the schedule's first slot (datetime.datetime)
+    :param interval: time between slots (datetime.timedelta)
+    :param after: the time to look after (datetime.datetime, optional,
+                  defaults to the first slot)
+    :returns: the slot (datetime.datetime)
     """
-    with Cursor() as c:
-        sql = """select scheduled_for
-              from test_schedule
-              where run = False
-              order by scheduled_for ASC
-              limit 1;
-              """
-        c.execute(sql)
-        sched = c.fetchone()
-    return sched if sched is None else sched[0]
+    if after is None or after < start:
+        return start
+    return start + ((after - start) // interval + 1) * interval
 
 
-def formatted_next_tests_scheduled():
-    """
-    Returns a formatted version of the time on which the next round of tests
-    are scheduled.
+# The recurring schedule rules as well as the next and the last run one-off
+# schedule, see get_schedule_state
+SCHEDULE_STATE_SQL = """select 'rule', start, interval_minutes, last_run
+              from schedule_rules
+              union all
+              select 'once',
+                  (select min(scheduled_for) from test_schedule
+                   where run = False),
+                  null,
+                  (select max(scheduled_for) from test_schedule
+                   where run = True);"""
+
 
-    The format is best specified by examples: 'never', 'now', 'in 2 days'
+def get_schedule_state():
+    """
+    Returns when tests are scheduled to run next and when scheduled tests
+    have last been run. Takes both the recurring schedule rules and the
+    one-off schedules into account, using a single query.
 
-    :returns: formatted time of next test (string)
+    :returns: dict with next and last_run (datetime.datetime or None each),
+              e.g. {'next': datetime(...), 'last_run': datetime(...)}
     """
-    sched = next_tests_scheduled()
-    if sched is None:
-        return 'never'
-    if sched <= datetime.utcnow():
-        return 'now'
-    diff = sched - datetime.utcnow()
-    if diff.days >= 1:
-        return "in {0} days".format(diff.days)
-    if diff.seconds >= 60:
-        return "in {0} min.".format(int(diff.seconds / 60))
-    else:
-        return "in {0} sec.".format(int(diff.seconds))
+    with Cursor() as c:
+        c.execute(SCHEDULE_STATE_SQL)
+        rows = c.fetchall()
+    nexts, last_runs = [], []
+    for kind, start, interval_minutes, last_run in rows:
+        # The next slot of a rule is the first one after its last run
+        if kind == 'rule':
+            interval = timedelta(minutes=interval_minutes)
+            nexts.append(get_next_slot(start, interval, last_run))
+        elif start is not None:
+            nexts.append(start)
+        if last_run is not None:
+            last_runs.append(last_run)
+    return {'next': min(nexts, default=None),
+            'last_run': max(last_runs, default=None)}
 
 
 def add_test_scheduling(by, sched_on=None, sched_for=None):
@@ -230,21 +361,48 @@ def add_test_scheduling(by, sched_on=None, sched_for=None):
         sql = """insert into test_schedule
               values ( % s, % s, % s, 0 ); """
         c.execute(sql, (by, sched_on, sched_for))
+        bump_results_generation(c)
+
+
+def bump_results_generation(c):
+    """
+    Bumps the results generation, which notifies open dashboards of new test
+    results or schedules, see components/events.py. Bumped in the writing
+    transaction so that it is visible together with the written rows.
+
+    :param c: the cursor of the writing transaction
+    """
+    sql = """update results_generation
+          set generation = generation + 1
+          where id = 1;"""
+    c.execute(sql)
 
 
-def scheduled_test_ran_since(date):
+def get_results_generation():
+    """
+    Returns the results generation, see bump_results_generation.
+
+    :returns: the generation (int), 0 if it has never been bumped
+    """
+    with Cursor() as c:
+        c.execute("select generation from results_generation where id = 1;")
+        row = c.fetchone()
+    return 0 if row is None else row[0]
+
+
+def scheduled_test_ran_since(date, state=None):
     """
     Returns whether a scheduled tests have run since given date.
     (Returns whether schedules for after date have been marked run).
 
-    :param date: given date (datetime.datetime or MySQL accepted string)
+    :param date: given date (datetime.datetime or isoformat string)
+    :param state: result of get_schedule_state (optional, looked up if not
+                  given)
     :returns: whether tests have run (boolean)
     """
-    with Cursor() as c:
-        sql = """select * from test_schedule
-              where scheduled_for >= %s
-              and scheduled_for <= utc_timestamp()
-              and run = True;"""
-        c.execute(sql, (date))
-    # If cursor returns entries, tests have been run
-    return len(c.fetchall()) > 0
+    if isinstance(date, str):
+        date = datetime.fromisoformat(date)
+    if state is None:
+        state = get_schedule_state()
+    last_run = state['last_run']
+    return last_run is not None and date <= last_run <= datetime.utcnow()
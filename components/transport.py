@@ -0,0 +1,194 @@
+import threading
+from subprocess import run, DEVNULL, TimeoutExpired
+
+from components.config import RUNNER_TRANSPORT, RUNNER_SSH_COMMAND
+from components.config import RUNNER_SSH_CONTROL_PATH, RUNNER_SSH_CONTROL_PERSIST
+
+
+# Where commands run as a job record the pid of their shell on the vm, see
+# get_job_command
+JOB_PID_FILE = '/tmp/status-monitor-{0}.pid'
+
+
+def get_job_command(remote_cmd, job):
+    """
+    Returns a command running remote_cmd as a job which can be killed with
+    the command returned by get_kill_command.
+
+    :param remote_cmd: the command to run on the vm (string)
+    :param job: the job's unique id (string)
+    :returns: the command (string)
+    """
+    pid_file = JOB_PID_FILE.format(job)
+    return "echo $$ > {0}; {1}; rc=$?; rm -f {0}; exit $rc".format(
+        pid_file, remote_cmd)
+
+
+def get_kill_command(job):
+    """
+    Returns a command terminating a job's command, e.g. timeout(1), which
+    then kills the job's whole process group.
+
+    :param job: the job's unique id (string)
+    :returns: the command (string)
+    """
+    pid_file = JOB_PID_FILE.format(job)
+    return "test -f {0} && pkill -TERM -P $(cat {0}); rm -f {0}".format(
+        pid_file)
+
+
+class SSHTransport(object):
+    """
+    Runs commands on vms using ssh, keeping one persistent, multiplexed
+    connection (an OpenSSH control master) per vm. Commands only open a new
+    channel on the vm's connection instead of doing a key exchange and
+    authentication each. Connections are reused across tests and rounds
+    and re-established if they died.
+
+    Usage:
+        transport = SSHTransport()
+        transport.prepare('vm01')
+        subprocess.run(transport.get_command('vm01', 'uptime'))
+    """
+
+    def __init__(self, ssh=RUNNER_SSH_COMMAND,
+                 control_path=RUNNER_SSH_CONTROL_PATH,
+                 control_persist=RUNNER_SSH_CONTROL_PERSIST):
+        self.ssh = ssh
+        self.options = ['-o', 'BatchMode=yes',
+                        '-o', 'ControlPath=' + control_path,
+                        # Let dead connections time out instead of hang
+                        '-o', 'ServerAliveInterval=15',
+                        '-o', 'ServerAliveCountMax=3']
+        self.control_persist = control_persist
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+
+    def get_lock(self, vm):
+        """
+        Returns the lock serializing the management of a vm's connection.
+
+        :param vm: the vm (string, e.g. 'vm01')
+        :returns: threading.Lock
+        """
+        with self.locks_lock:
+            return self.locks.setdefault(vm, threading.Lock())
+
+    def is_connected(self, vm):
+        """
+        Checks whether the vm's persistent connection is up. Only talks to
+        the local control master, not to the vm.
+
+        :param vm: the vm (string, e.g. 'vm01')
+        :returns: whether the connection is up (boolean)
+        """
+        cmd = [self.ssh] + self.options + ['-O', 'check', vm]
+        return run(cmd, stdin=DEVNULL, stdout=DEVNULL,
+                   stderr=DEVNULL).returncode == 0
+
+    def prepare(self, vm):
+        """
+        Establishes the vm's persistent connection unless it is up already.
+        If establishing fails, commands fall back to their own connection.
+
+        :param vm: the vm (string, e.g. 'vm01')
+        """
+        with self.get_lock(vm):
+            if self.is_connected(vm):
+                return
+            # Start a master in the background, detached from our pipes
+            cmd = ([self.ssh] + self.options +
+                   ['-o', 'ControlPersist=' + self.control_persist,
+                    '-M', '-N', '-f', vm])
+            try:
+                run(cmd, stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL,
+                    timeout=60)
+            except TimeoutExpired:
+                print("[Test runner] Connecting to {0} timed out".format(vm))
+
+    def get_command(self, vm, remote_cmd, job=None):
+        """
+        Returns the command running a command on a vm.
+
+        :param vm: the vm (string, e.g. 'vm01')
+        :param remote_cmd: the command to run on the vm (string)
+        :param job: unique id to run the command as a job with, see kill
+                    (string, optional)
+        :returns: the command (list of strings)
+        """
+        if job is not None:
+            remote_cmd = get_job_command(remote_cmd, job)
+        return [self.ssh] + self.options + [vm, remote_cmd]
+
+    def kill(self, vm, job):
+        """
+        Kills a job's command on a vm, which keeps running once its ssh
+        process has been killed. Uses the vm's persistent connection.
+
+        :param vm: the vm (string, e.g. 'vm01')
+        :param job: the job's unique id (string)
+        """
+        cmd = [self.ssh] + self.options + [vm, get_kill_command(job)]
+        try:
+            run(cmd, stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL,
+                timeout=60)
+        except TimeoutExpired:
+            print("[Test runner] Killing job {0} on {1} timed out"
+                  .format(job, vm))
+
+
+class LocalTransport(object):
+    """
+    Runs commands on this host instead of on the vms, e.g. for testing the
+    test runner against local stand-ins of the tests.
+    """
+
+    def prepare(self, vm):
+        """
+        Does nothing, there is no connection to establish.
+
+        :param vm: the vm (string, e.g. 'vm01')
+        """
+        pass
+
+    def get_command(self, vm, remote_cmd, job=None):
+        """
+        Returns the command running a command locally.
+
+        :param vm: the vm, ignored (string, e.g. 'vm01')
+        :param remote_cmd: the command to run (string)
+        :param job: unique id to run the command as a job with, see kill
+                    (string, optional)
+        :returns: the command (list of strings)
+        """
+        if job is not None:
+            remote_cmd = get_job_command(remote_cmd, job)
+        return ['sh', '-c', remote_cmd]
+
+    def kill(self, vm, job):
+        """
+        Kills a job's command, which timeout(1) runs in its own process
+        group.
+
+        :param vm: the vm, ignored (string, e.g. 'vm01')
+        :param job: the job's unique id (string)
+        """
+        run(['sh', '-c', get_kill_command(job)], stdin=DEVNULL,
+            stdout=DEVNULL, stderr=DEVNULL)
+
+
+# Available transports by their name in RUNNER_TRANSPORT
+transports = {
+    'ssh': SSHTransport,
+    'local': LocalTransport
+}
+
+
+def get_transport(name=RUNNER_TRANSPORT):
+    """
+    Returns a new transport of the given type.
+
+    :param name: the transport's name, 'ssh' or 'local'
+    :returns: SSHTransport or LocalTransport
+    """
+    return transports[name]()
@@ -1,5 +1,3 @@
-import os
-import threading
 from urllib import parse
 import dash_core_components as dcc
 import dash_html_components as html
@@ -7,10 +5,12 @@ from dash.dependencies import Input, Output
 from dash.exceptions import PreventUpdate
 
 from app import app
-from scheduler import loop
 from components import auth, config
+from components.common_layout import get_page_caches_layout
 from apps.topbar import layout as topbar
 from apps import status, status_week, vms, vms_vm, history, account, login, logout
+# Registers the /events route notifying dashboards of new test results
+from components import events
 
 
 app.layout = html.Div([
@@ -19,7 +19,9 @@ app.layout = html.Div([
     # Top bar of the app
     topbar,
     # content will be rendered in this element
-    html.Div(id='page-content', style={"margin": "8px"})
+    html.Div(id='page-content', style={"margin": "8px"}),
+    # the pages' content kept in the browser
+    get_page_caches_layout()
 ])
 
 
@@ -77,12 +79,5 @@ def display_page(pathname, search):
 
 
 if __name__ == '__main__':
-    # Do not create threads twice, see https://stackoverflow.com/a/9476701
-    # for details why this is necessary and done like this
-    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
-        print("[Scheduler] Creating thread")
-        scheduler = threading.Thread(target=loop)
-        scheduler.start()
-        print("[Scheduler] Thread creation finished")
     print("[Server] Started/reloaded")
     app.run_server(debug=config.SERVER_DEBUG_MODE, host=config.SERVER_HOST)
@@ -0,0 +1,9 @@
+"""
+Adds an index for looking up a test's results on a vm ordered by date, used
+e.g. for the last result of a test and for a test's history.
+"""
+
+
+def up(c):
+    c.execute("""create index test_vm_date
+              on test_results (test, vm, date);""")
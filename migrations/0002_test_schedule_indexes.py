@@ -0,0 +1,10 @@
+"""
+Adds a covering index for finding (not) run schedules by time, used e.g.
+for the next scheduled tests and for checking whether tests have run since a
+given date.
+"""
+
+
+def up(c):
+    c.execute("""create index run_scheduled_for
+              on test_schedule (run, scheduled_for);""")
@@ -0,0 +1,23 @@
+"""
+Replaces the scheduler's materialized 15 minute schedules by a recurring
+schedule rule. A rule's slots are start, start + interval, ..., i.e. start
+also fixes the slots' alignment. last_run is the last slot tests have been
+run for. Only one-off schedules ("Schedule now") remain in test_schedule.
+"""
+
+
+def up(c):
+    c.execute("""create table schedule_rules (
+              name varchar(48),
+              interval_minutes int not null,
+              start datetime not null,
+              last_run datetime,
+              primary key (name)
+              );""")
+    # Continue where the materialized schedule left off
+    c.execute("""insert into schedule_rules
+              select 'scheduler', 15, '2020-01-01 00:00:00', max(scheduled_for)
+              from test_schedule
+              where by_user = 'scheduler' and run = True;""")
+    c.execute("""delete from test_schedule
+              where by_user = 'scheduler';""")
@@ -0,0 +1,24 @@
+"""
+Stores every distinct test output once in test_outputs, keyed by its SHA-256
+hash, instead of a copy per test result. test_results references the output
+by output_hash, see components.tests.get_output_hash. Existing outputs are
+deduplicated.
+"""
+
+
+def up(c):
+    c.execute("""create table test_outputs (
+              hash char(64),
+              output mediumtext not null,
+              primary key (hash)
+              );""")
+    c.execute("""alter table test_results
+              add column output_hash char(64) after failed;""")
+    # Hash the same bytes as get_output_hash does
+    c.execute("""update test_results
+              set output_hash = sha2(convert(output using utf8mb4), 256);""")
+    c.execute("""insert ignore into test_outputs (hash, output)
+              select output_hash, output from test_results;""")
+    c.execute("""alter table test_results
+              drop column output,
+              modify output_hash char(64) not null;""")
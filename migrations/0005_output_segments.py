@@ -0,0 +1,16 @@
+"""
+Allows test outputs to be stored in the segment store (see
+components/output_store.py) instead of the database. Such outputs have no
+output but their segment, offset and compressed length instead.
+"""
+
+
+def up(c):
+    c.execute("""alter table test_outputs
+              modify output mediumtext,
+              add column segment int,
+              add column segment_offset bigint,
+              add column segment_length int;""")
+    # Used by compaction to find a segment's outputs
+    c.execute("""create index segment_offset
+              on test_outputs (segment, segment_offset);""")
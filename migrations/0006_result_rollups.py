@@ -0,0 +1,42 @@
+"""
+Adds the hourly and daily rollups of old test results, see
+components/retention.py. A rollup counts the runs of a test on a vm within
+its hour or day, sums their passed and failed checks, keeps the lowest and
+highest ratio of passed checks and references the output of the first
+failing run.
+"""
+
+
+def up(c):
+    c.execute("""create table test_results_hourly (
+              test varchar(48),
+              vm varchar(8),
+              hour datetime,
+              runs int not null,
+              passed int not null,
+              failed int not null,
+              min_ratio float,
+              max_ratio float,
+              first_failure_hash char(64),
+              primary key (test, vm, hour),
+              index (first_failure_hash)
+              );""")
+    c.execute("""create table test_results_daily (
+              test varchar(48),
+              vm varchar(8),
+              day date,
+              runs int not null,
+              passed int not null,
+              failed int not null,
+              min_ratio float,
+              max_ratio float,
+              first_failure_hash char(64),
+              primary key (test, vm, day),
+              index (first_failure_hash)
+              );""")
+    # Used for finding the outputs no longer referenced
+    c.execute("""create index output_hash
+              on test_results (output_hash);""")
+    # Used for finding the results to roll up
+    c.execute("""create index date
+              on test_results (date);""")
@@ -0,0 +1,12 @@
+"""
+Records the months of a partitioned test_results which have been rolled up
+but whose partitions may not have been dropped yet, see
+components.retention.rollup_partition.
+"""
+
+
+def up(c):
+    c.execute("""create table rolled_up_months (
+              month date,
+              primary key (month)
+              );""")
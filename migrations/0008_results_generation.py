@@ -0,0 +1,15 @@
+"""
+Adds the results generation, a counter bumped whenever test results or test
+schedules are written. Web server processes watch it to notify open
+dashboards of changes, see components/events.py.
+"""
+
+
+def up(c):
+    c.execute("""create table results_generation (
+              id tinyint,
+              generation bigint not null,
+              primary key (id)
+              );""")
+    c.execute("""insert into results_generation
+              values ( 1, 0 );""")
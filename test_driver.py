@@ -0,0 +1,204 @@
+"""
+Runs several tests within a single python process on a vm. The test runner
+sends this script to the vm's python interpreter and reads the tests'
+outputs back from its stdout.
+
+Every test runs in a forked child process, sparing the interpreter's
+startup for each test. The outputs are written as frames, each a header
+line "<FRAME_MARKER> <test> <kind> <value>" followed by a payload:
+- kind 'data': value bytes of the test's output follow
+- kind 'exit': the test finished with returncode value, no payload follows
+
+Usage:
+    python3.7 - [-j JOBS] [-t TIMEOUT] test1 test2 ... < test_driver.py
+"""
+import os
+import sys
+import time
+import runpy
+import select
+import signal
+import argparse
+import traceback
+
+
+# Starts the header line of every frame
+FRAME_MARKER = b'#status-monitor-frame'
+
+# Directory containing the tests on the vms
+TESTS_DIR = '/root/tests'
+
+# Returncode of tests that have been killed after timing out, same as the
+# one of timeout(1)
+TIMEOUT_RETURNCODE = 124
+
+# Signals on which the driver kills the running tests and exits, e.g. sent
+# by timeout(1) or on hangup of the ssh connection
+EXIT_SIGNALS = [signal.SIGTERM, signal.SIGHUP, signal.SIGINT]
+
+# Pids of the children running tests, each leading its own process group
+children = set()
+
+
+def write_frame(test, kind, value, payload=b''):
+    """
+    Writes one frame to stdout.
+
+    :param test: the test the frame belongs to (string, e.g. 'dns')
+    :param kind: the frame's kind, 'data' or 'exit'
+    :param value: the payload's length or the returncode (int)
+    :param payload: the frame's payload (bytes)
+    """
+    header = ' '.join([FRAME_MARKER.decode(), test, kind, str(value)])
+    sys.stdout.buffer.write(header.encode() + b'\n' + payload)
+    sys.stdout.buffer.flush()
+
+
+def run_in_child(path):
+    """
+    Runs a test script as __main__ in the current (forked) process and exits
+    with the test's returncode.
+
+    :param path: the test script's path (string)
+    """
+    code = 0
+    try:
+        sys.argv = [path]
+        runpy.run_path(path, run_name='__main__')
+    except SystemExit as e:
+        # Mirror the interpreter's handling of sys.exit(...)
+        if e.code is None or isinstance(e.code, int):
+            code = 0 if e.code is None else e.code
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def kill_children(signum, _):
+    """
+    Kills the process groups of all running tests and exits, since they
+    would keep running without a deadline otherwise.
+
+    :param signum: the received signal (int)
+    """
+    for pid in children:
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    os._exit(128 + signum)
+
+
+def start_test(test):
+    """
+    Forks a child running the given test in its own process group with stdout
+    and stderr redirected to a pipe.
+
+    :param test: the test to run (string, e.g. 'dns')
+    :returns: the child's pid & the pipe's read end (pair of ints)
+    """
+    read_fd, write_fd = os.pipe()
+    # Do not let the child inherit (and write) our buffered output
+    sys.stdout.flush()
+    pid = os.fork()
+    if pid == 0:
+        os.setpgid(0, 0)
+        for signum in EXIT_SIGNALS:
+            signal.signal(signum, signal.SIG_DFL)
+        os.close(read_fd)
+        os.dup2(write_fd, 1)
+        os.dup2(write_fd, 2)
+        os.close(write_fd)
+        run_in_child(os.path.join(TESTS_DIR, test + '.py'))
+    # Also set by the parent, so the group exists once the test is killed
+    os.setpgid(pid, pid)
+    os.close(write_fd)
+    children.add(pid)
+    return pid, read_fd
+
+
+def get_returncode(status):
+    """
+    Converts a wait status into a returncode like the shell does.
+
+    :param status: the status returned by os.waitpid
+    :returns: the returncode (int)
+    """
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def finish_test(test, pid, read_fd, killed=False):
+    """
+    Reaps a test's child and writes its exit frame.
+
+    :param test: the test (string, e.g. 'dns')
+    :param pid: the child's pid (int)
+    :param read_fd: the read end of the child's pipe (int)
+    :param killed: whether the child has been killed after timing out
+    """
+    os.close(read_fd)
+    _, status = os.waitpid(pid, 0)
+    children.discard(pid)
+    returncode = TIMEOUT_RETURNCODE if killed else get_returncode(status)
+    write_frame(test, 'exit', returncode)
+
+
+def run_tests(tests, jobs, timeout):
+    """
+    Runs the given tests with at most jobs of them at once, killing tests
+    running for longer than timeout seconds.
+
+    :param tests: the tests to run (list of strings, e.g. ['dns'])
+    :param jobs: number of tests to run at once (int)
+    :param timeout: seconds after which a test is killed (int)
+    """
+    for signum in EXIT_SIGNALS:
+        signal.signal(signum, kill_children)
+    pending = list(tests)
+    # Running tests by the read end of their pipes: (test, pid, deadline)
+    running = {}
+    while len(pending) > 0 or len(running) > 0:
+        while len(pending) > 0 and len(running) < jobs:
+            test = pending.pop(0)
+            pid, read_fd = start_test(test)
+            running[read_fd] = (test, pid, time.monotonic() + timeout)
+        next_deadline = min(map(lambda x: x[2], running.values()))
+        wait = max(0, next_deadline - time.monotonic())
+        readable, _, _ = select.select(list(running), [], [], wait)
+        for read_fd in readable:
+            test, pid, _ = running[read_fd]
+            data = os.read(read_fd, 65536)
+            if len(data) > 0:
+                write_frame(test, 'data', len(data), data)
+            else:
+                # End of output, the test finished
+                del running[read_fd]
+                finish_test(test, pid, read_fd)
+        for read_fd, (test, pid, deadline) in list(running.items()):
+            if time.monotonic() >= deadline:
+                del running[read_fd]
+                try:
+                    os.killpg(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                finish_test(test, pid, read_fd, killed=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run tests in one process.")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="number of tests to run at once")
+    parser.add_argument('-t', '--timeout', type=int, default=600,
+                        help="seconds after which a test is killed")
+    parser.add_argument('tests', nargs='*')
+    args = parser.parse_args()
+    run_tests(args.tests, args.jobs, args.timeout)
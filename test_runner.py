@@ -1,148 +1,936 @@
+import os
+import math
+import codecs
+import time
+import uuid
+import shlex
+import signal
+import asyncio
 import pymysql
+import argparse
+import selectors
 import threading
 from time import sleep
-from subprocess import run
+from functools import partial
+from collections import OrderedDict, deque
+from subprocess import Popen, PIPE, STDOUT
 from datetime import datetime
 
 from components.sql import Cursor, WriteCursor
+from components.config import RUNNER_MAX_WORKERS, RUNNER_MAX_PER_VM
+from components.config import RUNNER_TEST_TIMEOUT, RUNNER_ENGINE
+from components.config import RUNNER_TRANSPORT, RUNNER_BATCH, RUNNER_BATCH_JOBS
+from components.config import RUNNER_WRITE_BATCH_SIZE, RUNNER_WRITE_FLUSH_INTERVAL
+from components.config import RUNNER_OUTPUT_CAP
+from components.tests import get_schedule_state, get_output_hash
+from components.tests import bump_results_generation
+from components.output_store import save_outputs
+from components.transport import get_transport, transports
+from test_driver import FRAME_MARKER, TIMEOUT_RETURNCODE
 
 
-def run_cmd(cmd):
+# The script running a batch of tests on a vm, see get_batch_command
+DRIVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'test_driver.py')
+
+# Seconds to wait for ssh after the remote timeout should have hit
+TIMEOUT_GRACE = 30
+
+# Bytes read from a pipe at once
+CHUNK_SIZE = 65536
+
+# Length from which an unterminated line of output is parsed in pieces
+MAX_LINE_LENGTH = 65536
+
+# Colored markers printed by the tests and their plain replacements
+COLORED_MARKERS = [('...\b\b\b\033[0;32m[OK]\033[0m', '[OK]'),      # Green
+                   ('...\b\b\b\033[0;31m[FAIL]\033[0m', '[FAIL]')]  # Red
+
+# Parts of the summary ending a test's output if nothing went wrong
+SUMMARIES = ["All tests passed!", " test(s) failed!"]
+
+# How commands are run on the vms, see components/transport.py
+transport = get_transport()
+
+
+def run_cmd(cmd, stdout, stderr=None, input=None):
     """
-    Returns the CompletedProcess instance of running the given command in a
-    shell and capturing stdout, stderr and returncode.
+    Runs the given command, feeding its output to the given captures while
+    it is read. Closes the captures once the command finished.
 
-    :param cmd: the command to execute (string)
-    :returns: CompletedProcess instance
+    :param cmd: the command to execute (list of strings)
+    :param stdout: capture of stdout, e.g. OutputCapture instance
+    :param stderr: capture of stderr (optional, stderr is merged into stdout
+                   if not given)
+    :param input: data sent to the command's stdin (bytes, optional)
+    :returns: the command's returncode (int)
     """
-    return run(cmd, capture_output=True, shell=True)
+    process = Popen(cmd, stdin=None if input is None else PIPE, stdout=PIPE,
+                    stderr=STDOUT if stderr is None else PIPE)
+    captures = {process.stdout: stdout}
+    if stderr is not None:
+        captures[process.stderr] = stderr
+    try:
+        if input is not None:
+            try:
+                process.stdin.write(input)
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+        with selectors.DefaultSelector() as selector:
+            for pipe in captures:
+                selector.register(pipe, selectors.EVENT_READ)
+            while len(selector.get_map()) > 0:
+                for key, _ in selector.select():
+                    data = os.read(key.fd, CHUNK_SIZE)
+                    if len(data) == 0:
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+                    else:
+                        captures[key.fileobj].feed(data)
+        return process.wait()
+    finally:
+        for capture in captures.values():
+            capture.close()
 
 
-def get_returncode(process):
+def get_test_command(test, vm, job=None):
     """
-    Get the returncode of a CompletedProcess instance.
+    Returns the command executing the given test on given vm. The test runs
+    under timeout(1) on the vm, which kills the test's whole process group
+    once RUNNER_TEST_TIMEOUT seconds have passed.
 
-    :param process: CompletedProcess instance
-    :returns: the process's returncode (int)
+    :param test: test to run (string, e.g. 'dns')
+    :param vm: vm to run test on (string, e.g. 'vm01')
+    :param job: unique id to run the test as a job with, see
+                components.transport (string, optional)
+    :returns: the command (list of strings)
     """
-    return process.returncode
+    remote_cmd = "timeout -k 5 {0} python3.7 /root/tests/{1}.py".format(
+        RUNNER_TEST_TIMEOUT, test)
+    return transport.get_command(vm, remote_cmd, job)
 
 
-def get_output(process):
+def get_timeout_message():
     """
-    Returns the output of given CompletedProcess instance. Uses both stdout
-    and stderr and removes test's bash coloring.
+    Returns the message appended to the output of timed out tests.
 
-    :param process: CompletedProcess instance
-    :returns: the process's output (string)
+    :returns: message (string)
     """
-    output = process.stdout.decode('utf-8') + process.stderr.decode('utf-8')
-    output = (output.replace('...\b\b\b\033[0;32m[OK]\033[0m', '[OK]')   # Remove green color
-              .replace('...\b\b\b\033[0;31m[FAIL]\033[0m', '[FAIL]'))    # Remove red color
-    return output
+    return "\n[Test runner] Test timed out after {0} seconds".format(
+        RUNNER_TEST_TIMEOUT)
 
 
-def check_output(output):
+class OutputCapture(object):
     """
-    Checks whether the output ends with a test summary, i.e. nothing went
-    wrong when executing the test.
+    Captures a test's output while it is read from the test's pipe. Decodes
+    and parses the output in a single pass, one line at a time: removes the
+    tests' bash coloring, counts the [OK] and [FAIL] markers and looks for
+    the test summary. Keeps at most cap characters of the output, its head
+    and its tail, leaving out the middle of longer outputs.
 
-    :param output: the test output (string)
-    :returns: whether test summary exists (boolean)
+    Usage:
+        capture = OutputCapture()
+        capture.feed(b'Checking dns...[OK]\n')
+        capture.close()
+        capture.get_output()
     """
-    return "All tests passed!" in output or " test(s) failed!" in output
 
+    def __init__(self, cap=RUNNER_OUTPUT_CAP):
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.head_size = cap // 2
+        self.tail_size = cap - self.head_size
+        self.head = []
+        self.head_length = 0
+        self.tail = deque()
+        self.tail_length = 0
+        self.omitted = 0
+        # The last, unterminated line
+        self.line = ''
+        self.passed = 0
+        self.failed = 0
+        self.summary = False
+
+    def feed(self, data):
+        """
+        Adds output read from the test's pipe.
+
+        :param data: the output (bytes)
+        """
+        self.write(self.decoder.decode(data))
+
+    def write(self, text):
+        """
+        Adds already decoded output.
+
+        :param text: the output (string)
+        """
+        lines = (self.line + text).split('\n')
+        self.line = lines.pop()
+        for line in lines:
+            self.add_line(line + '\n')
+        # Do not let a test printing without newlines exhaust the memory,
+        # markers split across the pieces of such lines are not counted
+        if len(self.line) >= MAX_LINE_LENGTH:
+            self.add_line(self.line)
+            self.line = ''
+
+    def close(self):
+        """
+        Adds the rest of the output once the test's pipe has been closed.
+        """
+        self.write(self.decoder.decode(b'', final=True))
+        if len(self.line) > 0:
+            self.add_line(self.line)
+            self.line = ''
+
+    def add_line(self, line):
+        """
+        Parses a line of the output and keeps it if it fits.
+
+        :param line: the line (string)
+        """
+        for colored, plain in COLORED_MARKERS:
+            line = line.replace(colored, plain)
+        self.passed += line.count('[OK]')
+        self.failed += line.count('[FAIL]')
+        self.summary = self.summary or any(map(lambda x: x in line, SUMMARIES))
+        # Fill the head first, then keep the latest lines in the tail
+        if self.head_length < self.head_size:
+            part = line[:self.head_size - self.head_length]
+            self.head.append(part)
+            self.head_length += len(part)
+            line = line[len(part):]
+        if len(line) == 0:
+            return
+        self.tail.append(line)
+        self.tail_length += len(line)
+        while self.tail_length > self.tail_size:
+            excess = self.tail_length - self.tail_size
+            if len(self.tail[0]) <= excess:
+                excess = len(self.tail.popleft())
+            else:
+                self.tail[0] = self.tail[0][excess:]
+            self.tail_length -= excess
+            self.omitted += excess
+
+    def get_output(self):
+        """
+        Returns the kept output, noting how much of it has been left out.
 
-def parse_output(output, returncode):
+        :returns: the output (string)
+        """
+        output = ''.join(self.head)
+        if self.omitted > 0:
+            output += ("\n[Test runner] {0} characters of output omitted\n"
+                       .format(self.omitted))
+        return output + ''.join(self.tail)
+
+
+def get_results(capture, returncode):
     """
-    Count how many tests have been passed and how many have been failed.
+    Returns the values for a test's database entry from its captured output.
     Handles tests that have not ended correctly by using dummy values
     instead.
 
-    :param output: the test output (string)
+    :param capture: OutputCapture instance of the finished test
     :param returncode: the test's returncode (int)
-    :returns: number of tests passed, number of tests failed
+    :returns: number of tests passed, number of tests failed, output
     """
+    output = capture.get_output()
+    if returncode == TIMEOUT_RETURNCODE:
+        output += get_timeout_message()
     # If test has failed before the test summary, return dummy values
-    if returncode != 0 or not check_output(output):
-        return 0, 1
-    passed = output.count("[OK]")
-    failed = output.count("[FAIL]")
-    return passed, failed
+    if returncode != 0 or not capture.summary:
+        return 0, 1, output
+    return capture.passed, capture.failed, output
+
+
+class ResultCollector(object):
+    """
+    Collects test results and writes them to the database in batches from a
+    background thread, using one executemany per table and batch. A batch is
+    written once batch_size results are waiting or the oldest waiting result
+    has waited for flush_interval seconds.
+
+    Usage:
+        results = ResultCollector()
+        results.add('dns', 'vm01', 2, 0, output, date)
+        results.close()
+    """
+
+    def __init__(self, batch_size=RUNNER_WRITE_BATCH_SIZE,
+                 flush_interval=RUNNER_WRITE_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.condition = threading.Condition()
+        # Waiting results and the time the oldest of them was added
+        self.results = []
+        self.oldest = None
+        self.closed = False
+        self.writer = threading.Thread(target=self.work)
+        self.writer.start()
+
+    def add(self, test, vm, passed, failed, output, date):
+        """
+        Adds a test's result to the next batch.
+
+        :param test: the test (string, e.g. 'dns')
+        :param vm: the vm the test ran on (string, e.g. 'vm01')
+        :param passed: number of tests passed (int)
+        :param failed: number of tests failed (int)
+        :param output: the test's output (string)
+        :param date: time the test finished (datetime isoformat string)
+        """
+        with self.condition:
+            if len(self.results) == 0:
+                self.oldest = time.monotonic()
+            self.results.append((test, vm, passed, failed, output, date))
+            self.condition.notify()
+
+    def close(self):
+        """
+        Writes the remaining results and stops the background thread.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.writer.join()
+
+    def next_batch(self):
+        """
+        Waits until a batch is due and takes it from the waiting results.
+
+        :returns: the batch (list) and whether the collector is closed
+        """
+        with self.condition:
+            while not self.closed and len(self.results) < self.batch_size:
+                if len(self.results) == 0:
+                    self.condition.wait()
+                    continue
+                remaining = self.oldest + self.flush_interval - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch = self.results[:self.batch_size]
+            self.results = self.results[self.batch_size:]
+            self.oldest = time.monotonic()
+            return batch, self.closed
+
+    def work(self):
+        """
+        Writes batches until the collector is closed and all results are
+        written. If a batch fails, its results are written one by one, the
+        ones failing again are retried after flush_interval seconds.
+        """
+        while True:
+            batch, closed = self.next_batch()
+            if len(batch) == 0 and closed:
+                return
+            try:
+                self.write(batch)
+                continue
+            except Exception as e:
+                print("[Test runner] Writing {0} results failed: {1}"
+                      .format(len(batch), e))
+            if len(batch) > 1:
+                batch = self.write_each(batch)
+            if len(batch) == 0:
+                continue
+            # Once closed, do not block the round any longer
+            if closed:
+                print("[Test runner] Dropping {0} results".format(len(batch)))
+                continue
+            with self.condition:
+                self.results = batch + self.results
+            sleep(self.flush_interval)
 
+    def write_each(self, batch):
+        """
+        Writes the results of a failed batch one by one, so that a single
+        bad result does not keep the others from being written. Stops once
+        the database is unavailable.
 
-def execute_test(test, vm):
+        :param batch: list of (test, vm, passed, failed, output, date)
+        :returns: the results not written (list)
+        """
+        failed = []
+        for i, result in enumerate(batch):
+            try:
+                self.write([result])
+            except pymysql.err.OperationalError as e:
+                print("[Test runner] Writing results failed: {0}".format(e))
+                return failed + batch[i:]
+            except Exception as e:
+                print("[Test runner] Writing the result of {0} on {1} failed: "
+                      "{2}".format(result[0], result[1], e))
+                failed.append(result)
+        return failed
+
+    def write(self, batch):
+        """
+        Writes a batch of results in a single transaction.
+
+        :param batch: list of (test, vm, passed, failed, output, date)
+        """
+        # Store every distinct output once, see get_output_hash
+        hashes = [get_output_hash(output) for _, _, _, _, output, _ in batch]
+        outputs = dict(zip(hashes, map(lambda x: x[4], batch)))
+        with WriteCursor() as c:
+            save_outputs(c, outputs)
+            sql = """insert into test_results
+                  (test, passed, failed, output_hash, date, vm)
+                  values ( %s, %s, %s, %s, %s, %s );"""
+            c.executemany(sql, [(test, passed, failed, output_hash, date, vm)
+                                for (test, vm, passed, failed, _, date),
+                                output_hash in zip(batch, hashes)])
+            # Update the latest results in the same transaction
+            sql = """insert into latest_results (test, vm, passed, failed, date)
+                  values ( %s, %s, %s, %s, %s )
+                  on duplicate key update
+                      passed = if(values(date) >= date, values(passed), passed),
+                      failed = if(values(date) >= date, values(failed), failed),
+                      date = greatest(values(date), date);"""
+            c.executemany(sql, [(test, vm, passed, failed, date)
+                                for test, vm, passed, failed, _, date
+                                in batch])
+            bump_results_generation(c)
+
+
+def execute_test(test, vm, results):
     """
     Executes the given test on given vm. Saves the results in the database.
 
     :param test: test to run (string, e.g. 'dns')
     :param vm: vm to run test on (string, e.g. 'vm01')
+    :param results: the ResultCollector to save the results with
     """
-    # Execute test
-    cmd = "ssh {0} \"python3.7 /root/tests/{1}.py\"".format(vm, test)
-    p = run_cmd(cmd)
-    # Get values for database entry
-    passed, failed = parse_output(get_output(p), get_returncode(p))
-    output = get_output(p)
+    transport.prepare(vm)
+    capture = OutputCapture()
+    returncode = run_cmd(get_test_command(test, vm), capture)
+    passed, failed, output = get_results(capture, returncode)
     date = datetime.utcnow().isoformat()
-    # Insert test into database
-    with WriteCursor() as c:
-        sql = """insert into test_results
-              values ( %s, %s, %s, %s, %s, %s );"""
-        c.execute(sql, (test, passed, failed, output, date, vm))
+    results.add(test, vm, passed, failed, output, date)
+
 
+def kill_process_group(process):
+    """
+    Kills the process group led by the given process, ignoring already
+    finished processes.
+
+    :param process: asyncio.subprocess.Process started in a new session
+    """
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+async def read_stream(stream, capture):
+    """
+    Feeds everything read from the given stream to the given capture.
+
+    :param stream: asyncio.StreamReader instance
+    :param capture: e.g. OutputCapture instance
+    """
+    while True:
+        data = await stream.read(CHUNK_SIZE)
+        if len(data) == 0:
+            return
+        capture.feed(data)
+
+
+async def run_cmd_async(cmd, timeout, stdout, stderr=None, input=None,
+                        kill=None):
+    """
+    Runs the given command without blocking the event loop, feeding its
+    output to the given captures while it is read. Kills the command's whole
+    process tree if it does not finish in time or if the calling task is
+    cancelled, including the processes it started on a vm if kill is given.
+    Closes the captures once the command finished.
 
-def get_scheduled_tests():
+    :param cmd: the command to execute (list of strings)
+    :param timeout: seconds after which the command is killed
+    :param stdout: capture of stdout, e.g. OutputCapture instance
+    :param stderr: capture of stderr (optional, stderr is merged into stdout
+                   if not given)
+    :param input: data sent to the command's stdin (bytes, optional)
+    :param kill: function killing the command's processes on the vm, which
+                 outlive the local process tree (optional)
+    :returns: the command's returncode (int) or None if it timed out
     """
-    Gets all the tests scheduled for now or before call from the database.
+    # Start a new session so that the command's whole process tree can be
+    # killed
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdin=None if input is None else PIPE, stdout=PIPE,
+        stderr=STDOUT if stderr is None else PIPE, start_new_session=True)
+
+    async def communicate():
+        if input is not None:
+            try:
+                process.stdin.write(input)
+                await process.stdin.drain()
+                process.stdin.close()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+        readers = [read_stream(process.stdout, stdout)]
+        if stderr is not None:
+            readers.append(read_stream(process.stderr, stderr))
+        await asyncio.gather(*readers)
+        return await process.wait()
+
+    async def stop():
+        # The job on the vm is found by the shell, which has to be alive
+        if kill is not None:
+            await asyncio.get_event_loop().run_in_executor(None, kill)
+        kill_process_group(process)
+
+    try:
+        return await asyncio.wait_for(communicate(), timeout)
+    except asyncio.TimeoutError:
+        await stop()
+        await process.wait()
+        return None
+    except asyncio.CancelledError:
+        await stop()
+        raise
+    finally:
+        stdout.close()
+        if stderr is not None:
+            stderr.close()
+
+
+async def execute_test_async(test, vm, results):
+    """
+    Executes the given test on given vm without blocking the event loop and
+    saves the results in the database. If the test does not finish in time,
+    it is killed and recorded as failed.
+
+    :param test: test to run (string, e.g. 'dns')
+    :param vm: vm to run test on (string, e.g. 'vm01')
+    :param results: the ResultCollector to save the results with
+    """
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, transport.prepare, vm)
+    capture = OutputCapture()
+    job = uuid.uuid4().hex
+    returncode = await run_cmd_async(get_test_command(test, vm, job),
+                                     RUNNER_TEST_TIMEOUT + TIMEOUT_GRACE,
+                                     capture,
+                                     kill=partial(transport.kill, vm, job))
+    # If ssh itself hangs, the test's processes on the vm are killed by
+    # timeout(1) in any case
+    if returncode is None:
+        returncode = TIMEOUT_RETURNCODE
+    passed, failed, output = get_results(capture, returncode)
+    date = datetime.utcnow().isoformat()
+    results.add(test, vm, passed, failed, output, date)
+
+
+def get_batch_command(tests, vm, job=None):
+    """
+    Returns the command executing the given tests on given vm with a single
+    python process running test_driver.py, which has to be sent to the
+    command's stdin.
+
+    :param tests: tests to run (list of strings, e.g. ['dns', 'dhcp'])
+    :param vm: vm to run tests on (string, e.g. 'vm01')
+    :param job: unique id to run the tests as a job with, see
+                components.transport (string, optional)
+    :returns: the command (list of strings)
+    """
+    remote_cmd = "timeout -k 5 {0} python3.7 - -j {1} -t {2} {3}".format(
+        get_batch_timeout(tests), RUNNER_BATCH_JOBS, RUNNER_TEST_TIMEOUT,
+        ' '.join(map(shlex.quote, tests)))
+    return transport.get_command(vm, remote_cmd, job)
+
 
-    :returns: list of tests (list of strings, e.g. ['dns'])
+def get_batch_timeout(tests):
     """
+    Returns the seconds after which a batch of tests is killed as a whole,
+    i.e. the time the driver needs if every test times out.
+
+    :param tests: tests in the batch (list of strings, e.g. ['dns', 'dhcp'])
+    :returns: seconds (int)
+    """
+    rounds = math.ceil(len(tests) / RUNNER_BATCH_JOBS)
+    return rounds * RUNNER_TEST_TIMEOUT + TIMEOUT_GRACE
+
+
+class FrameParser(object):
+    """
+    Splits the output of test_driver.py into the tests' outputs and
+    returncodes while it is read, feeding every test's output to its own
+    OutputCapture. Stops at the first malformed frame.
+
+    Usage:
+        frames = FrameParser(['dns', 'dhcp'])
+        frames.feed(data)
+        frames.close()
+        frames.captures['dns'], frames.returncodes.get('dns')
+    """
+
+    def __init__(self, tests):
+        self.captures = {test: OutputCapture() for test in tests}
+        # Returncodes of the finished tests
+        self.returncodes = {}
+        # Data not parsed yet, at most a part of a header line
+        self.buffer = b''
+        # The test whose output is read and the number of its bytes left
+        self.test = None
+        self.remaining = 0
+        self.broken = False
+
+    def feed(self, data):
+        """
+        Parses output read from the driver's stdout.
+
+        :param data: the output (bytes)
+        """
+        if self.broken:
+            return
+        self.buffer += data
+        while len(self.buffer) > 0:
+            if self.remaining > 0:
+                payload = self.buffer[:self.remaining]
+                self.buffer = self.buffer[len(payload):]
+                self.remaining -= len(payload)
+                self.captures[self.test].feed(payload)
+                continue
+            end = self.buffer.find(b'\n')
+            if end < 0:
+                self.broken = len(self.buffer) > MAX_LINE_LENGTH
+                return
+            header = self.buffer[:end].split(b' ')
+            self.buffer = self.buffer[end + 1:]
+            if (len(header) != 4 or header[0] != FRAME_MARKER
+                    or not header[3].isdigit()):
+                self.broken = True
+                return
+            test, kind, value = header[1].decode(), header[2], int(header[3])
+            self.captures.setdefault(test, OutputCapture())
+            if kind == b'data':
+                self.test, self.remaining = test, value
+            else:
+                self.returncodes[test] = value
+
+    def close(self):
+        """
+        Closes the tests' captures once the driver's stdout has been closed.
+        """
+        for capture in self.captures.values():
+            capture.close()
+
+
+def get_batch_results(tests, frames, returncode, stderr):
+    """
+    Returns the values for the tests' database entries from the output of a
+    finished batch. Tests the driver did not report on count as failed.
+
+    :param tests: tests in the batch (list of strings, e.g. ['dns', 'dhcp'])
+    :param frames: FrameParser instance the driver's stdout was fed to
+    :param returncode: the batch's returncode (int) or None if it timed out
+    :param stderr: OutputCapture instance of the driver's stderr
+    :returns: list of (test, passed, failed, output)
+    """
+    results = []
+    for test in tests:
+        capture = frames.captures[test]
+        test_returncode = frames.returncodes.get(test)
+        if test_returncode is None:
+            # The batch died or timed out before the test finished
+            reason = (get_timeout_message() if returncode is None else
+                      stderr.get_output())
+            capture.write(reason)
+            test_returncode = 1
+        results.append((test,) + get_results(capture, test_returncode))
+    return results
+
+
+def execute_batch(tests, vm, results):
+    """
+    Executes the given tests on given vm with a single python process and
+    saves the results in the database.
+
+    :param tests: tests to run (list of strings, e.g. ['dns', 'dhcp'])
+    :param vm: vm to run tests on (string, e.g. 'vm01')
+    :param results: the ResultCollector to save the results with
+    """
+    transport.prepare(vm)
+    frames, stderr = FrameParser(tests), OutputCapture()
+    returncode = run_cmd(get_batch_command(tests, vm), frames, stderr,
+                         get_driver())
+    date = datetime.utcnow().isoformat()
+    for test, passed, failed, output in get_batch_results(
+            tests, frames, returncode, stderr):
+        results.add(test, vm, passed, failed, output, date)
+
+
+async def execute_batch_async(tests, vm, results):
+    """
+    Executes the given tests on given vm with a single python process without
+    blocking the event loop and saves the results in the database.
+
+    :param tests: tests to run (list of strings, e.g. ['dns', 'dhcp'])
+    :param vm: vm to run tests on (string, e.g. 'vm01')
+    :param results: the ResultCollector to save the results with
+    """
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, transport.prepare, vm)
+    frames, stderr = FrameParser(tests), OutputCapture()
+    job = uuid.uuid4().hex
+    returncode = await run_cmd_async(get_batch_command(tests, vm, job),
+                                     get_batch_timeout(tests),
+                                     frames, stderr, get_driver(),
+                                     kill=partial(transport.kill, vm, job))
+    date = datetime.utcnow().isoformat()
+    for test, passed, failed, output in get_batch_results(
+            tests, frames, returncode, stderr):
+        results.add(test, vm, passed, failed, output, date)
+
+
+def get_driver():
+    """
+    Returns the source of test_driver.py, which runs a batch of tests on a
+    vm.
+
+    :returns: the source (bytes)
+    """
+    with open(DRIVER_PATH, 'rb') as f:
+        return f.read()
+
+
+def group_by_vm(tests):
+    """
+    Groups tests by the vm they run on.
+
+    :param tests: list of tests & vms (list of pairs, e.g. [('dns', 'vm01')])
+    :returns: list of tests per vm (list of pairs, e.g. [(['dns'], 'vm01')])
+    """
+    vms = OrderedDict()
+    for test, vm in tests:
+        vms.setdefault(vm, []).append(test)
+    return [(vm_tests, vm) for vm, vm_tests in vms.items()]
+
+
+def get_scheduled_tests(now):
+    """
+    Gets all the tests from the database if a schedule is due at given time.
+
+    :param now: the current time (datetime.datetime)
+    :returns: list of tests & vms (list of pairs, e.g. [('dns', 'vm01')])
+    """
+    sched = get_schedule_state()['next']
+    if sched is None or sched > now:
+        return []
     with Cursor() as c:
-        sql = """select run_on.test, run_on.vm from run_on
-                where exists (
-                    select * from test_schedule
-                    where scheduled_for <= utc_timestamp() and run = False
-                );"""
-        c.execute(sql)
+        c.execute("select test, vm from run_on;")
         return c.fetchall()
 
 
-def set_schedules_run():
+def set_schedules_run(until):
     """
-    Sets all the tests scheduled for before current time to run.
+    Sets all the tests scheduled for before given time to run, i.e. marks the
+    one-off schedules run and advances the schedule rules' last run to
+    their last slot before given time.
+
+    :param until: the time tests have been run for (datetime.datetime)
     """
     with WriteCursor() as c:
         sql = """update test_schedule
               set run = True
-              where scheduled_for <= utc_timestamp();"""
-        c.execute(sql)
+              where run = False and scheduled_for <= %s;"""
+        c.execute(sql, (until))
+        sql = """update schedule_rules
+              set last_run = start + interval (
+                  floor(timestampdiff(minute, start, %s) / interval_minutes)
+                  * interval_minutes) minute
+              where start <= %s;"""
+        c.execute(sql, (until, until))
+        bump_results_generation(c)
+
+
+class TestExecutor(object):
+    """
+    Executes jobs on at most max_workers threads, running at most max_per_vm
+    jobs on the same vm at once. Jobs that can not be started yet are queued,
+    vms take turns in starting their queued jobs.
+
+    Jobs are tuples of arguments whose last element is the vm, e.g.
+    ('dns', 'vm01').
+
+    Usage:
+        stats = TestExecutor().run(execute_test, [('dns', 'vm01'), ...])
+    """
+
+    def __init__(self, max_workers=RUNNER_MAX_WORKERS,
+                 max_per_vm=RUNNER_MAX_PER_VM):
+        self.max_workers = max_workers
+        self.max_per_vm = max_per_vm
+        self.condition = threading.Condition()
+        # Queued jobs by vm, the vm to start a job on next comes first
+        self.queues = OrderedDict()
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        # Number of jobs currently running by vm
+        self.running = {}
+
+    def run(self, function, jobs):
+        """
+        Calls function(*job) for all jobs and waits for all of them to finish.
+
+        :param function: the function to call
+        :param jobs: list of argument tuples, the last element being the vm
+        :returns: dict with number of jobs, maximum number of jobs waiting
+                  while others ran and makespan in seconds, e.g. {'jobs': 10, 'max_queue_depth': 2,
+                  'makespan': 7.3}
+        """
+        start = time.monotonic()
+        with self.condition:
+            for job in jobs:
+                self.queues.setdefault(job[-1], deque()).append(job)
+                self.running.setdefault(job[-1], 0)
+            self.queue_depth = len(jobs)
+        n_workers = min(self.max_workers, len(jobs))
+        workers = [threading.Thread(target=self.work, args=(function,))
+                   for _ in range(n_workers)]
+        [w.start() for w in workers]
+        [w.join() for w in workers]
+        return {'jobs': len(jobs),
+                'max_queue_depth': self.max_queue_depth,
+                'makespan': time.monotonic() - start}
+
+    def work(self, function):
+        """
+        Starts queued jobs until the queue is empty.
 
+        :param function: the function to call with the jobs' arguments
+        """
+        while True:
+            with self.condition:
+                job = self.next_job()
+                # Wait for a job on a different vm to finish
+                while job is None and self.queue_depth > 0:
+                    self.condition.wait()
+                    job = self.next_job()
+                if job is None:
+                    return
+            try:
+                function(*job)
+            except Exception as e:
+                print("[Test runner] Executing {0} failed: {1}".format(job, e))
+            finally:
+                with self.condition:
+                    self.running[job[-1]] -= 1
+                    self.condition.notify_all()
+
+    def next_job(self):
+        """
+        Takes the next job that may be started from the queue. Must be called
+        with the condition held.
+
+        :returns: the job or None if no job may be started right now
+        """
+        for vm, queue in self.queues.items():
+            if len(queue) > 0 and self.running[vm] < self.max_per_vm:
+                self.running[vm] += 1
+                self.queue_depth -= 1
+                self.max_queue_depth = max(self.max_queue_depth,
+                                           self.queue_depth)
+                # Let the other vms go first next time
+                self.queues.move_to_end(vm)
+                return queue.popleft()
+        return None
+
+
+class AsyncTestExecutor(TestExecutor):
+    """
+    Executes coroutine jobs on an asyncio event loop with the same limits as
+    TestExecutor.
+
+    Usage:
+        stats = asyncio.run(AsyncTestExecutor().run(execute_test_async, jobs))
+    """
+
+    async def run(self, function, jobs):
+        """
+        Awaits function(*job) for all jobs.
 
-def loop():
+        :param function: the coroutine function to call
+        :param jobs: list of argument tuples, the last element being the vm
+        :returns: dict with number of jobs, maximum number of jobs waiting
+                  while others ran and makespan in seconds, see TestExecutor
+        """
+        start = time.monotonic()
+        self.queue_depth = len(jobs)
+        limit = asyncio.Semaphore(self.max_workers)
+        vm_limits = {job[-1]: asyncio.Semaphore(self.max_per_vm)
+                     for job in jobs}
+
+        async def work(job):
+            # Only take up a global slot once the vm has capacity
+            async with vm_limits[job[-1]], limit:
+                self.queue_depth -= 1
+                self.max_queue_depth = max(self.max_queue_depth,
+                                           self.queue_depth)
+                try:
+                    await function(*job)
+                except Exception as e:
+                    print("[Test runner] Executing {0} failed: {1}"
+                          .format(job, e))
+        await asyncio.gather(*map(work, jobs))
+        return {'jobs': len(jobs),
+                'max_queue_depth': self.max_queue_depth,
+                'makespan': time.monotonic() - start}
+
+
+def run_tests(tests, engine, batch):
+    """
+    Executes the given tests with the given engine.
+
+    :param tests: list of tests & vms (list of pairs, e.g. [('dns', 'vm01')])
+    :param engine: 'threads' or 'asyncio'
+    :param batch: whether to run each vm's tests in a single process
+    :returns: the executor's statistics (dict)
+    """
+    jobs = group_by_vm(tests) if batch else tests
+    results = ResultCollector()
+    try:
+        if engine == 'asyncio':
+            function = execute_batch_async if batch else execute_test_async
+            function = partial(function, results=results)
+            return asyncio.run(AsyncTestExecutor().run(function, jobs))
+        function = execute_batch if batch else execute_test
+        return TestExecutor().run(partial(function, results=results), jobs)
+    finally:
+        # Make sure all results are written before the round ends
+        results.close()
+
+
+def loop(engine=RUNNER_ENGINE, batch=RUNNER_BATCH):
     """
     Loops infinitely and executes scheduled tests
+
+    :param engine: how to execute tests, 'threads' or 'asyncio'
+    :param batch: whether to run each vm's tests in a single process
     """
     while True:
+        now = datetime.utcnow()
         try:
-            tests = get_scheduled_tests()
+            tests = get_scheduled_tests(now)
         except pymysql.err.OperationalError as e:
             print("[Test runner] Connection to database failed: {0}".format(e))
             sleep(5)
             continue
         # If there are tests scheduled, execute them and mark them run
         if len(tests) > 0:
-            print(("[Test runner] Creating {0} threads for executing tests"
-                   .format(len(tests))))
-            threads = [threading.Thread(target=execute_test, args=test)
-                       for test in tests]
-            print("[Test runner] Starting threads")
-            [t.start() for t in threads]
-            print("[Test runner] Joining threads")
-            [t.join() for t in threads]
+            print("[Test runner] Executing {0} tests".format(len(tests)))
+            stats = run_tests(tests, engine, batch)
+            print(("[Test runner] Executed {jobs} jobs in {makespan:.1f} s, "
+                   "max. queue depth {max_queue_depth}").format(**stats))
             try:
-                set_schedules_run()
-            except pymysql.err.OperationalError:
+                set_schedules_run(now)
+            except pymysql.err.OperationalError as e:
                 print("[Test runner] Connection to database failed while: {0}".format(e))
                 continue
             print("[Test runner] Schedule(s) set to run, loop finished")
@@ -151,4 +939,15 @@ def loop():
 
 
 if __name__ == "__main__":
-    loop()
+    parser = argparse.ArgumentParser(description="Execute scheduled tests.")
+    parser.add_argument('--engine', choices=['threads', 'asyncio'],
+                        default=RUNNER_ENGINE,
+                        help="how to execute tests (default: %(default)s)")
+    parser.add_argument('--batch', action='store_true', default=RUNNER_BATCH,
+                        help="run each vm's tests in a single process")
+    parser.add_argument('--transport', choices=list(transports),
+                        default=RUNNER_TRANSPORT,
+                        help="how to reach the vms (default: %(default)s)")
+    args = parser.parse_args()
+    transport = get_transport(args.transport)
+    loop(args.engine, args.batch)